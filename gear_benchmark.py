@@ -0,0 +1,286 @@
+"""
+Benchmark suite for the simulator backends and the renderer.
+
+    python -m gear_benchmark --output results.json
+    python -m gear_benchmark --workloads random --random-sizes 1000 2000 --backends numpy
+
+Workloads:
+  - wire:    the circuit of grid_editor.create_wire_grid tiled N times.
+  - or_gate: the circuit of grid_editor.create_OR_gate tiled N times.
+  - random:  an S x S grid filled like grid_editor.create_my_gear_grid1 (3 layers, each
+             tooth present with probability 3/7), with the corner gears of every 7 x 7 block
+             as drivers.
+
+For every workload and backend, iterate (prepare_iteration + iterate), rotate_gears,
+copy, save_grid_state / load_grid_state (.json and .mmg) and GearGridVisualizer.draw_grid
+are timed separately. draw_grid is timed both for full frames (the first frame of a tick,
+which redraws the static background) and for the sub-steps drawn over the cached background. The results are written as JSON so that runs on different backends or
+commits can be compared.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+import gear_format
+import grid_editor
+from gear_logic import MultiLayerGearGrid, SparseGearGrid
+from gear_numpy import NumpyGearGrid
+from gear_visualization import GearGridVisualizer
+
+WORKLOADS = ("wire", "or_gate", "random")
+BACKENDS = ("python", "incremental", "sparse", "numpy")
+
+# Backends built from MultiLayerGear objects, and their propagation engine.
+_OBJECT_BACKENDS = {
+    "python": (MultiLayerGearGrid, "worklist"),
+    "incremental": (MultiLayerGearGrid, "incremental"),
+    "sparse": (SparseGearGrid, "worklist"),
+}
+
+
+# Workload generators
+
+def tile_grid(tile, tiles_y, tiles_x):
+    """
+    Return a MultiLayerGearGrid holding tiles_y x tiles_x copies of the grid `tile`.
+    """
+    grid = MultiLayerGearGrid(tile.rows * tiles_y, tile.cols * tiles_x,
+                              tile.num_layers, tile.num_teeth)
+    for ti in range(tiles_y):
+        for tj in range(tiles_x):
+            for i, j, gear in tile.iter_gears():
+                grid.grid[ti * tile.rows + i][tj * tile.cols + j] = gear.copy()
+    return grid
+
+
+def tiled_workload(tile, copies):
+    """
+    Tile `tile` at least `copies` times, as close to a square arrangement as possible.
+    """
+    tiles_y = max(1, math.isqrt(copies))
+    tiles_x = -(-copies // tiles_y)
+    return tile_grid(tile, tiles_y, tiles_x)
+
+
+def random_workload(size, seed=0, num_layers=3, num_teeth=8):
+    """
+    Return a size x size NumpyGearGrid filled like grid_editor.create_my_gear_grid1. It is
+    built from arrays, so grids of millions of gears are created in seconds.
+    """
+    rng = np.random.default_rng(seed)
+    np_grid = NumpyGearGrid(size, size, num_layers, num_teeth)
+    for layer in range(num_layers):
+        # Each tooth is present with probability 3/7.
+        flags = rng.integers(0, 7, size=(size, size, num_teeth), dtype=np.uint8) < 3
+        np_grid.teeth[layer] = gear_format.pack_teeth(flags, num_teeth)
+
+    corner = np.isin(np.arange(size) % 7, (0, 6))
+    np_grid.driver = corner[:, None] & corner[None, :]
+    return np_grid
+
+
+def make_backend(base, backend):
+    """
+    Build an independent grid for `backend` from a MultiLayerGearGrid or NumpyGearGrid.
+    """
+    if backend == "numpy":
+        if isinstance(base, NumpyGearGrid):
+            return base.copy()
+        return NumpyGearGrid.from_grid(base)
+
+    grid_class, propagation = _OBJECT_BACKENDS[backend]
+    grid = base.to_grid() if isinstance(base, NumpyGearGrid) else base.copy()
+    if grid_class is SparseGearGrid:
+        grid = SparseGearGrid.from_grid(grid)
+    grid.propagation = propagation
+    return grid
+
+
+# Timing
+
+def _summary(seconds, gears):
+    best = min(seconds)
+    return {
+        "runs": len(seconds),
+        "best": best,
+        "mean": statistics.fmean(seconds),
+        "median": statistics.median(seconds),
+        "best_ns_per_gear": best / gears * 1e9,
+    }
+
+
+def _timed(func, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def benchmark_grid(grid, ticks=10, warmup=3, repeat=3, draw_frames=3, max_draw_gears=5000,
+                   max_json_gears=250000, workdir=None):
+    """
+    Time the operations of one grid and return {"timings": ..., "file_sizes": ...}.
+    Times are in seconds; iterate and rotate_gears are per tick.
+    """
+    gears = grid.rows * grid.cols
+    timings = {}
+
+    for _ in range(warmup):
+        grid.step()
+    iterate_times = []
+    rotate_times = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        grid.prepare_iteration()
+        grid.iterate()
+        middle = time.perf_counter()
+        grid.rotate_gears()
+        iterate_times.append(middle - start)
+        rotate_times.append(time.perf_counter() - middle)
+    timings["iterate"] = _summary(iterate_times, gears)
+    timings["rotate_gears"] = _summary(rotate_times, gears)
+
+    timings["copy"] = _summary(_timed(grid.copy, repeat), gears)
+
+    file_sizes = {}
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        extensions = ("json", "mmg") if gears <= max_json_gears else ("mmg",)
+        for extension in extensions:
+            filename = os.path.join(tmp, f"grid.{extension}")
+            timings[f"save_{extension}"] = _summary(
+                _timed(lambda: grid.save_grid_state(filename), repeat), gears)
+            file_sizes[extension] = os.path.getsize(filename)
+            timings[f"load_{extension}"] = _summary(
+                _timed(lambda: grid.__class__.load_grid_state(filename), repeat), gears)
+
+    if isinstance(grid, MultiLayerGearGrid) and gears <= max_draw_gears and draw_frames:
+        visualizer = GearGridVisualizer(grid, base_radius=20, save=False)
+        grid.prepare_iteration()
+        grid.iterate()
+        # Cycle through the sub-step angles that the viewers draw between two ticks.
+        angles = iter([15 * k % 45 for k in range(2 * draw_frames)])
+
+        def full_frame():
+            visualizer.invalidate_background()
+            visualizer.draw_grid(next(angles))
+
+        timings["draw_grid"] = _summary(_timed(full_frame, draw_frames), gears)
+        timings["draw_grid_substep"] = _summary(
+            _timed(lambda: visualizer.draw_grid(next(angles)), draw_frames), gears)
+
+    return {"timings": timings, "file_sizes": file_sizes}
+
+
+def build_workloads(workloads, tiles, random_sizes, seed=0):
+    """
+    Yield (workload, scale, base grid) for every requested workload and scale.
+    """
+    sources = {"wire": grid_editor.create_wire_grid, "or_gate": grid_editor.create_OR_gate}
+    for workload in workloads:
+        if workload == "random":
+            for size in random_sizes:
+                yield workload, size, random_workload(size, seed=seed)
+        else:
+            tile = sources[workload]()
+            for copies in tiles:
+                yield workload, copies, tiled_workload(tile, copies)
+
+
+def run_benchmarks(workloads=WORKLOADS, backends=BACKENDS, tiles=(1, 16, 256),
+                   random_sizes=(100, 300, 1000, 2000), max_object_gears=250000, seed=0,
+                   **options):
+    """
+    Run every workload on every backend and return the list of result dicts. Object
+    backends are skipped for grids above `max_object_gears`, which would need gigabytes of
+    MultiLayerGear objects.
+    """
+    results = []
+    for workload, scale, base in build_workloads(workloads, tiles, random_sizes, seed):
+        for backend in backends:
+            result = {
+                "workload": workload,
+                "scale": scale,
+                "rows": base.rows,
+                "cols": base.cols,
+                "gears": base.rows * base.cols,
+                "backend": backend,
+            }
+            if backend != "numpy" and result["gears"] > max_object_gears:
+                result["skipped"] = f"more than {max_object_gears} gears for an object backend"
+            else:
+                start = time.perf_counter()
+                grid = make_backend(base, backend)
+                result["build_seconds"] = time.perf_counter() - start
+                result.update(benchmark_grid(grid, **options))
+            results.append(result)
+            _print_result(result)
+    return results
+
+
+def _print_result(result):
+    label = f"{result['workload']}[{result['scale']}] {result['backend']:<11} {result['gears']:>9} gears"
+    if "skipped" in result:
+        print(f"{label}  skipped: {result['skipped']}")
+        return
+    cells = [f"{name} {timing['best'] * 1000:.2f}ms" for name, timing in result["timings"].items()]
+    print(f"{label}  " + "  ".join(cells))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the gear simulator and renderer.")
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS))
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--tiles", nargs="+", type=int, default=[1, 16, 256],
+                        help="number of copies of the wire / OR gate circuits")
+    parser.add_argument("--random-sizes", nargs="+", type=int, default=[100, 300, 1000, 2000],
+                        help="side lengths of the random grids")
+    parser.add_argument("--ticks", type=int, default=10, help="timed ticks per grid")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed ticks before timing")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="repetitions of copy, save and load")
+    parser.add_argument("--draw-frames", type=int, default=3,
+                        help="timed full and sub-step draw_grid frames (0 disables draw_grid)")
+    parser.add_argument("--max-draw-gears", type=int, default=5000,
+                        help="skip draw_grid above this many gears")
+    parser.add_argument("--max-json-gears", type=int, default=250000,
+                        help="skip JSON save/load above this many gears")
+    parser.add_argument("--max-object-gears", type=int, default=250000,
+                        help="skip the python/incremental/sparse backends above this many gears")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random workload")
+    parser.add_argument("--output", default="benchmark_results.json",
+                        help="JSON file for the results (default: benchmark_results.json)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        workloads=args.workloads, backends=args.backends, tiles=args.tiles,
+        random_sizes=args.random_sizes, max_object_gears=args.max_object_gears, seed=args.seed,
+        ticks=args.ticks, warmup=args.warmup, repeat=args.repeat,
+        draw_frames=args.draw_frames, max_draw_gears=args.max_draw_gears,
+        max_json_gears=args.max_json_gears)
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "arguments": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""
+Streaming export of an animation to an animated GIF or a video, without writing every frame
+to images/ and reading it back.
+
+    python -m gear_export wire.json presentation/wire.gif --ticks 200
+    python -m gear_export OR_gate.json or_gate.mp4 --ticks 500 --fps 30
+    python -m gear_export wire.json wire.mp4 --ticks 2400 --workers 8
+
+or, from code, around any render loop:
+
+    with open_export("wire.gif", duration=100) as export:
+        ...
+        visualizer.draw_grid(delta_angle)
+        export.write(visualizer.canvas, f"Iter {tick}")
+
+Every frame is labelled, encoded and written as soon as it is drawn, so memory use stays
+the same however long the recording is. GIFs use one global palette built from the
+renderer's colours (gear_palette) and, after the first frame, only store the rectangle that
+changed since the previous frame, with the unchanged pixels in it transparent; any other
+file name is written with cv2.VideoWriter.
+"""
+import argparse
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import GifImagePlugin, Image
+
+from gear_logic import MultiLayerGearGrid
+from gear_visualization import GearGridVisualizer, layer_colors, state_colors
+
+# Palette index left out of gear_palette() and used for the unchanged pixels of delta frames.
+TRANSPARENT_INDEX = 255
+
+
+def label_frame(image, text):
+    """
+    Stamp `text` in white on a black box in the top-left corner of `image`, in place.
+    """
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 1
+    thickness = 2
+    text_size = cv2.getTextSize(text, font, font_scale, thickness)[0]
+    text_x = 10
+    text_y = text_size[1] + 10  # Padding from the top.
+
+    # Black rectangle behind the text for readability.
+    cv2.rectangle(image, (text_x - 5, text_y - text_size[1] - 5),
+                  (text_x + text_size[0] + 5, text_y + 5), (0, 0, 0), -1)
+    cv2.putText(image, text, (text_x, text_y), font, font_scale, (255, 255, 255), thickness)
+
+
+def gear_palette():
+    """
+    Return the 255 colours of the GIF palette, as canvas colour triples: black, the
+    level-of-detail state colours, the outline and driver colours, every layer colour, and
+    greys for the labels up to 255 entries.
+    """
+    colors = [(0, 0, 0)] + [tuple(color) for color in state_colors.tolist()]
+    colors += [(255, 0, 0), (0, 255, 255)] + list(layer_colors)
+    colors += [(v, v, v) for v in range(0, 256, 4)] + [(v, v, v) for v in range(2, 256, 4)]
+    colors = list(dict.fromkeys(colors))[:TRANSPARENT_INDEX]
+    colors += [(0, 0, 0)] * (TRANSPARENT_INDEX - len(colors))
+    return colors
+
+
+class GifExport:
+    """
+    Write frames to an animated GIF as they are drawn. `duration` is the time each frame
+    is shown in milliseconds and `loop` the number of loops (0 = forever). `palette` is a
+    list of up to 255 (R, G, B) colours that every frame is mapped to, gear_palette() by
+    default.
+
+    After the first frame, only the bounding box of the pixels that differ from the
+    previous frame is stored, as a frame that leaves the previous one in place
+    (disposal 1) and whose unchanged pixels are transparent. In a mostly static circuit
+    that box covers the turning gears and the label.
+
+    The canvas bytes are used as RGB, as make_gif has always done, so that new recordings
+    have the same colours as the GIFs in presentation/.
+    """
+    def __init__(self, filename, duration=100, loop=0, palette=None):
+        self.filename = filename
+        self.duration = duration
+        self.loop = loop
+        self.frames = 0
+
+        colors = list(palette or gear_palette())[:TRANSPARENT_INDEX]
+        # The transparent slot repeats the first colour, and pixels mapped to it are moved
+        # back to index 0.
+        colors += [colors[0]] * (TRANSPARENT_INDEX + 1 - len(colors))
+        self._palette = Image.new("P", (1, 1))
+        self._palette.putpalette([value for color in colors for value in color])
+
+        self._previous = None  # Last frame written, as given (with its label).
+        self._file = open(filename, "wb")
+
+    def _indexed(self, image):
+        # Map an (h, w, 3) image to palette indices.
+        frame = Image.fromarray(np.ascontiguousarray(image)).quantize(
+            palette=self._palette, dither=Image.Dither.NONE)
+        indices = np.asarray(frame).copy()
+        indices[indices == TRANSPARENT_INDEX] = 0
+        return indices
+
+    def _frame(self, indices):
+        frame = Image.fromarray(indices, mode="P")
+        frame.putpalette(self._palette.getpalette())
+        return frame
+
+    def write(self, image, label=None):
+        """
+        Append the (height, width, 3) uint8 `image`, with `label` stamped on a copy of it.
+        """
+        if label is not None:
+            image = image.copy()
+            label_frame(image, label)
+
+        previous = self._previous
+        if previous is None:
+            frame = self._frame(self._indexed(image))
+            header, _ = GifImagePlugin.getheader(frame, info={"loop": self.loop,
+                                                              "duration": self.duration})
+            self._file.write(b"".join(header))
+            data = GifImagePlugin.getdata(frame, duration=self.duration)
+        else:
+            changed = np.any(image != previous, axis=2)
+            rows = np.flatnonzero(changed.any(axis=1))
+            cols = np.flatnonzero(changed.any(axis=0))
+            if len(rows):
+                y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+            else:
+                y0, y1, x0, x1 = 0, 1, 0, 1  # Nothing changed: a single transparent pixel.
+            indices = self._indexed(image[y0:y1, x0:x1])
+            indices[~changed[y0:y1, x0:x1]] = TRANSPARENT_INDEX
+            data = GifImagePlugin.getdata(self._frame(indices), offset=(int(x0), int(y0)),
+                                          duration=self.duration, disposal=1,
+                                          transparency=TRANSPARENT_INDEX)
+        self._file.write(b"".join(data))
+        self._previous = image.copy() if label is None else image
+        self.frames += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.write(b";")  # GIF trailer.
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class VideoExport:
+    """
+    Write BGR frames to a video with cv2.VideoWriter. The codec is given by `fourcc`; the
+    frame size is taken from the first frame.
+    """
+    def __init__(self, filename, fps=10, fourcc="mp4v"):
+        self.filename = filename
+        self.fps = fps
+        self.fourcc = fourcc
+        self.frames = 0
+        self._writer = None
+
+    def write(self, image, label=None):
+        """
+        Append the BGR `image`, with `label` stamped on a copy of it.
+        """
+        if label is not None:
+            image = image.copy()
+            label_frame(image, label)
+        if self._writer is None:
+            height, width = image.shape[:2]
+            self._writer = cv2.VideoWriter(self.filename, cv2.VideoWriter_fourcc(*self.fourcc),
+                                           self.fps, (width, height))
+            if not self._writer.isOpened():
+                raise OSError(f"Could not open {self.filename} for writing with {self.fourcc}")
+        self._writer.write(image)
+        self.frames += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_export(filename, duration=100, loop=0, fps=None, fourcc="mp4v"):
+    """
+    Return a GifExport for a .gif `filename`, a VideoExport otherwise. The video frame rate
+    defaults to one frame per `duration` milliseconds.
+    """
+    if filename.lower().endswith(".gif"):
+        return GifExport(filename, duration=duration, loop=loop)
+    return VideoExport(filename, fps=fps or 1000 / duration, fourcc=fourcc)
+
+
+def record(grid, visualizer, export, ticks, steps_per_rotation=3, label="Iter {tick}"):
+    """
+    Run `grid` for `ticks` ticks and write `steps_per_rotation` frames per tick, drawn by
+    `visualizer`, to `export`. `label` is formatted with the tick number (None for no
+    label).
+    """
+    angle_step = 360 / grid.num_teeth / steps_per_rotation
+    for tick in range(ticks):
+        grid.prepare_iteration()
+        grid.iterate()
+        text = label.format(tick=tick) if label is not None else None
+        for step in range(steps_per_rotation):
+            visualizer.draw_grid(angle_step * step)
+            export.write(visualizer.canvas, text)
+        grid.rotate_gears()
+
+
+# Parallel offline rendering
+
+def simulate(grid, ticks):
+    """
+    Run `grid` for `ticks` ticks without drawing, yielding (tick, phases, rotated) for each:
+    the phases of every gear before the tick's rotation (see get_phases) and the positions
+    of the gears that turn on it, which is everything needed to draw the tick's frames.
+    """
+    for _ in range(ticks):
+        grid.prepare_iteration()
+        grid.iterate()
+        tick, phases = grid.tick, grid.get_phases()
+        grid.rotate_gears()
+        yield tick, phases, grid.last_rotated
+
+
+# Visualizer (holding its own grid) of a render worker process, set by _init_render_worker.
+_worker_visualizer = None
+
+
+def _init_render_worker(grid, view, visualizer_options):
+    global _worker_visualizer
+    _worker_visualizer = GearGridVisualizer(grid, save=False, **visualizer_options)
+    _worker_visualizer.set_window(*view)
+
+
+def _render_tick(tick, phases, rotated, angles, label):
+    # Put the worker's grid in the recorded state of `tick` and draw its frames.
+    visualizer = _worker_visualizer
+    grid = visualizer.gear_grid
+    grid.set_phases(phases, tick=tick)
+    for _, _, gear in grid.iter_gears():
+        gear.will_rotate = False
+    for i, j in rotated:
+        grid.gear_at(i, j).will_rotate = True
+
+    frames = []
+    for angle in angles:
+        visualizer.draw_grid(angle)
+        frame = visualizer.canvas.copy()
+        if label is not None:
+            label_frame(frame, label)
+        frames.append(frame)
+    return frames
+
+
+def render_parallel(grid, export, ticks, steps_per_rotation=3, label="Iter {tick}",
+                    workers=None, view=(0, 0, 1.0), **visualizer_options):
+    """
+    Like record(), but the frames are drawn by `workers` processes (default: one per
+    core), each with its own copy of the grid and a GearGridVisualizer built from
+    `visualizer_options` and looking at `view` (window_x, window_y, zoom).
+
+    The main process only simulates, which is much faster than drawing, and hands each
+    tick's recorded phases to the pool. The frames come back in order and are written to
+    `export`; at most a few ticks per worker are in flight, so memory use does not grow
+    with `ticks`.
+    """
+    workers = workers or os.cpu_count() or 1
+    angle_step = 360 / grid.num_teeth / steps_per_rotation
+    angles = [angle_step * step for step in range(steps_per_rotation)]
+
+    # Workers start from a copy, which drops the rotation listeners and caches.
+    with ProcessPoolExecutor(workers, initializer=_init_render_worker,
+                             initargs=(grid.copy(), view, visualizer_options)) as pool:
+        pending = deque()
+        for tick, phases, rotated in simulate(grid, ticks):
+            text = label.format(tick=tick) if label is not None else None
+            pending.append(pool.submit(_render_tick, tick, phases, rotated, angles, text))
+            if len(pending) >= 2 * workers:
+                for frame in pending.popleft().result():
+                    export.write(frame)
+        while pending:
+            for frame in pending.popleft().result():
+                export.write(frame)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a gear grid animation to a GIF or video.")
+    parser.add_argument("grid", help="grid file to load (.json or .mmg)")
+    parser.add_argument("output", help="output file (.gif, or a video such as .mp4)")
+    parser.add_argument("-n", "--ticks", type=int, default=100,
+                        help="number of ticks to record (default: 100)")
+    parser.add_argument("--steps", type=int, default=3,
+                        help="frames per tick (default: 3)")
+    parser.add_argument("--duration", type=int, default=100,
+                        help="milliseconds per frame (default: 100)")
+    parser.add_argument("--fps", type=float, help="video frame rate (default: 1000 / duration)")
+    parser.add_argument("--base-radius", type=float, default=25, help="gear size in pixels")
+    parser.add_argument("--size", type=int, nargs=2, default=(1050, 500),
+                        metavar=("WIDTH", "HEIGHT"), help="frame size (default: 1050 500)")
+    parser.add_argument("--zoom", type=float, default=1.0, help="zoom of the view")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="render processes; 0 for one per core (default: 1, no pool)")
+    args = parser.parse_args(argv)
+
+    grid = MultiLayerGearGrid.load_grid_state(args.grid)
+    options = {"base_radius": args.base_radius,
+               "screen_width": args.size[0], "screen_height": args.size[1]}
+    with open_export(args.output, duration=args.duration, fps=args.fps) as export:
+        if args.workers == 1:
+            visualizer = GearGridVisualizer(grid, save=False, **options)
+            visualizer.zoom = args.zoom
+            record(grid, visualizer, export, args.ticks, steps_per_rotation=args.steps)
+        else:
+            render_parallel(grid, export, args.ticks, steps_per_rotation=args.steps,
+                            workers=args.workers or None, view=(0, 0, args.zoom), **options)
+    print(f"Wrote {export.frames} frames to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
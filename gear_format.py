@@ -0,0 +1,146 @@
+"""
+Binary .mmg grid format.
+
+A .mmg file is a 64-byte little-endian header followed by five planes, each stored as a
+C-ordered array starting on an 8-byte boundary:
+
+  teeth        (num_layers, rows, cols)  uint8/16/32/64, bit k set if tooth k is present
+  gear_type    (rows, cols)              uint8, 1 for 'Driver' and 0 for 'Driven'
+  direction    (rows, cols)              int8, +1 or -1
+  phase        (rows, cols)              uint8 (uint16 above 256 teeth)
+  will_rotate  (rows, cols)              uint8
+
+The teeth are stored at phase 0; a gear shows tooth k at (k - phase * direction) % num_teeth,
+exactly like MultiLayerGear. read_mmg maps the planes with np.memmap, so opening a file
+costs the same no matter how many gears it holds.
+"""
+import struct
+
+import numpy as np
+
+MMG_MAGIC = b"MMG\0"
+MMG_VERSION = 1
+HEADER_SIZE = 64
+
+# magic, version, header size, rows, cols, num_layers, num_teeth,
+# teeth itemsize, phase itemsize
+_HEADER = struct.Struct("<4sHHIIIIBB")
+
+
+def teeth_dtype(num_teeth):
+    """
+    Return the smallest unsigned integer dtype that holds one bit per tooth.
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if num_teeth <= np.iinfo(dtype).bits:
+            return np.dtype(dtype).newbyteorder("<")
+    raise ValueError(f"num_teeth={num_teeth} does not fit in a 64-bit tooth mask")
+
+
+def phase_dtype(num_teeth):
+    return np.dtype(np.uint8 if num_teeth <= 256 else np.uint16).newbyteorder("<")
+
+
+def _plane_layout(rows, cols, num_layers, num_teeth):
+    """
+    Return a list of (name, dtype, shape, offset) for every plane, and the file size.
+    """
+    planes = [
+        ("teeth", teeth_dtype(num_teeth), (num_layers, rows, cols)),
+        ("gear_type", np.dtype(np.uint8), (rows, cols)),
+        ("direction", np.dtype(np.int8), (rows, cols)),
+        ("phase", phase_dtype(num_teeth), (rows, cols)),
+        ("will_rotate", np.dtype(np.uint8), (rows, cols)),
+    ]
+    layout = []
+    offset = HEADER_SIZE
+    for name, dtype, shape in planes:
+        layout.append((name, dtype, shape, offset))
+        size = dtype.itemsize * int(np.prod(shape))
+        offset += (size + 7) // 8 * 8
+    return layout, offset
+
+
+def write_mmg(filename, rows, cols, num_layers, num_teeth, planes):
+    """
+    Write a .mmg file.
+
+    :param planes: Dict with the arrays "teeth", "gear_type", "direction", "phase" and
+                   "will_rotate", shaped as described in the module docstring.
+    """
+    layout, _ = _plane_layout(rows, cols, num_layers, num_teeth)
+    header = _HEADER.pack(MMG_MAGIC, MMG_VERSION, HEADER_SIZE, rows, cols, num_layers,
+                          num_teeth, teeth_dtype(num_teeth).itemsize,
+                          phase_dtype(num_teeth).itemsize)
+
+    with open(filename, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        for name, dtype, shape, offset in layout:
+            f.write(b"\0" * (offset - f.tell()))
+            data = np.ascontiguousarray(planes[name], dtype=dtype)
+            if data.shape != shape:
+                raise ValueError(f"Plane {name!r} has shape {data.shape}, expected {shape}")
+            f.write(data.tobytes())
+
+
+def read_mmg_header(filename):
+    """
+    Return (rows, cols, num_layers, num_teeth) from a .mmg file header.
+    """
+    with open(filename, "rb") as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE:
+        raise ValueError(f"{filename} is too short to be a .mmg file")
+
+    (magic, version, header_size, rows, cols, num_layers, num_teeth,
+     teeth_itemsize, phase_itemsize) = _HEADER.unpack_from(raw)
+    if magic != MMG_MAGIC:
+        raise ValueError(f"{filename} is not a .mmg file")
+    if version != MMG_VERSION or header_size != HEADER_SIZE:
+        raise ValueError(f"Unsupported .mmg version {version} in {filename}")
+    if (teeth_itemsize != teeth_dtype(num_teeth).itemsize or
+            phase_itemsize != phase_dtype(num_teeth).itemsize):
+        raise ValueError(f"Corrupt .mmg header in {filename}")
+    return rows, cols, num_layers, num_teeth
+
+
+def read_mmg(filename, mode="c"):
+    """
+    Open a .mmg file without copying its planes.
+
+    :param mode: np.memmap mode. The default "c" (copy-on-write) lets callers modify the
+                 arrays in memory without touching the file.
+    :return:     (rows, cols, num_layers, num_teeth, planes) where planes maps each plane
+                 name to a memory-mapped array.
+    """
+    rows, cols, num_layers, num_teeth = read_mmg_header(filename)
+    layout, size = _plane_layout(rows, cols, num_layers, num_teeth)
+
+    planes = {}
+    for name, dtype, shape, offset in layout:
+        if int(np.prod(shape)) == 0:
+            planes[name] = np.zeros(shape, dtype=dtype)
+        else:
+            planes[name] = np.memmap(filename, dtype=dtype, mode=mode, offset=offset, shape=shape)
+    return rows, cols, num_layers, num_teeth, planes
+
+
+def pack_teeth(flags, num_teeth):
+    """
+    Pack a boolean array (..., num_teeth) into one unsigned int per entry, bit k for tooth k.
+    """
+    dtype = teeth_dtype(num_teeth)
+    packed = np.packbits(np.asarray(flags, dtype=bool), axis=-1, bitorder="little")
+    padded = np.zeros(packed.shape[:-1] + (dtype.itemsize,), dtype=np.uint8)
+    padded[..., :packed.shape[-1]] = packed
+    return padded.view(dtype)[..., 0]
+
+
+def unpack_teeth(teeth, num_teeth):
+    """
+    Inverse of pack_teeth: return a boolean array (..., num_teeth).
+    """
+    teeth = np.asarray(teeth)
+    bytes_view = np.ascontiguousarray(teeth.astype(teeth.dtype.newbyteorder("<"))).view(np.uint8)
+    bytes_view = bytes_view.reshape(teeth.shape + (teeth.dtype.itemsize,))
+    return np.unpackbits(bytes_view, axis=-1, bitorder="little")[..., :num_teeth].astype(bool)
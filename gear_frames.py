@@ -0,0 +1,116 @@
+"""
+Background PNG writing for rendered frames.
+
+GearGridVisualizer hands every saved frame to a FrameWriter, which queues a copy of the
+canvas and returns at once; worker threads convert and encode the PNGs. OpenCV releases the
+GIL while converting and encoding, so the workers run alongside the render loop and each
+other without the cost of sending frames to other processes. At most `max_pending` frames
+wait in the queue: when the encoders fall behind, submit() blocks until one is free, so a
+fast renderer is slowed down instead of filling memory.
+
+    writer = FrameWriter(workers=4, max_pending=16)
+    visualizer = GearGridVisualizer(grid, base_radius=25, frame_writer=writer)
+    ...
+    writer.close()  # Waits for the queued frames.
+"""
+import atexit
+import queue
+import threading
+
+import cv2
+
+
+class FrameWriter:
+    """
+    Write frames to PNG files on `workers` threads. `compression` is the PNG compression
+    level, 0 (fastest, largest) to 9; None keeps OpenCV's default, level 1 with run-length
+    encoding, which is several times faster than any explicit level. An error raised while
+    writing a frame is raised again by the next submit(), flush() or close().
+
+    Frames still queued when the interpreter exits are written first.
+    """
+    def __init__(self, workers=2, max_pending=8, compression=None):
+        self.compression = compression
+        self.frames_written = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._work, name=f"FrameWriter-{k}",
+                                          daemon=True)
+                         for k in range(workers)]
+        for thread in self._threads:
+            thread.start()
+        atexit.register(self.close)
+
+    def submit(self, image, filename):
+        """
+        Queue a copy of the BGR `image` to be written to `filename`. Blocks while
+        `max_pending` frames are already waiting.
+        """
+        self._raise_error()
+        if self._closed:
+            raise ValueError("FrameWriter is closed")
+        self._queue.put((image.copy(), filename))
+
+    def _work(self):
+        params = []
+        if self.compression is not None:
+            params = [cv2.IMWRITE_PNG_COMPRESSION, self.compression]
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                image, filename = item
+                # The same channel order as GearGridVisualizer has always saved.
+                image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                if not cv2.imwrite(filename, image_rgb, params):
+                    raise OSError(f"Could not write {filename}")
+                with self._lock:
+                    self.frames_written += 1
+            except Exception as e:
+                with self._lock:
+                    if self._error is None:
+                        self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        with self._lock:
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    @property
+    def pending(self):
+        """
+        Number of frames queued and not yet picked up by a worker.
+        """
+        return self._queue.qsize()
+
+    def flush(self):
+        """
+        Wait until every queued frame has been written.
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Write the queued frames and stop the worker threads.
+        """
+        if not self._closed:
+            self._closed = True
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            atexit.unregister(self.close)
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
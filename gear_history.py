@@ -0,0 +1,125 @@
+"""
+Recorded grid history for seeking and rewinding (see TickHistory).
+
+A rotation bitmap is an int with bit i * cols + j set for every gear (i, j) that turned
+during one tick.
+"""
+from collections import OrderedDict
+
+
+def rotation_bitmap(grid, positions):
+    """
+    Pack a list of (i, j) grid positions into an int with bit i * cols + j set.
+    """
+    # Setting bits in a bytearray keeps this linear in len(positions); or-ing shifted ints
+    # would copy the whole bitmap for every position.
+    data = bytearray((grid.rows * grid.cols + 7) // 8)
+    cols = grid.cols
+    for i, j in positions:
+        index = i * cols + j
+        data[index >> 3] |= 1 << (index & 7)
+    return int.from_bytes(data, "little")
+
+
+def iter_bits(bitmap):
+    """
+    Yield the indices of the set bits of `bitmap` in increasing order.
+    """
+    bits = bin(bitmap)[:1:-1]  # Least significant bit first.
+    index = bits.find("1")
+    while index >= 0:
+        yield index
+        index = bits.find("1", index + 1)
+
+
+class TickHistory:
+    """
+    Records a grid's past so that any recorded tick can be restored quickly:
+      - a keyframe (every gear's phase, see MultiLayerGearGrid.get_phases) every
+        `keyframe_interval` ticks;
+      - for every tick, a bitmap of the gears that rotate_gears() turned.
+
+    restore(tick) starts from the nearest keyframe at or before `tick` and replays at most
+    `keyframe_interval` rotation bitmaps, without re-running the propagation.
+
+    When the recorded data exceeds `memory_budget` bytes, the oldest keyframes are evicted
+    together with the bitmaps that lead up to the next one, so the history becomes a sliding
+    window ending at the latest recorded tick.
+    """
+    def __init__(self, grid, keyframe_interval=64, memory_budget=64 * 1024 * 1024):
+        self.grid = grid
+        self.keyframe_interval = keyframe_interval
+        self.memory_budget = memory_budget
+
+        self.keyframes = OrderedDict()  # tick -> phases at that tick
+        self.rotations = {}             # tick -> (bitmap, steps) applied by the next rotation
+        self.memory_used = 0
+
+        self.latest_tick = grid.tick
+        self._add_keyframe(grid.tick, grid.get_phases())
+
+    @property
+    def earliest_tick(self):
+        return next(iter(self.keyframes))
+
+    def record(self, steps=1):
+        """
+        Record the rotation that the grid has just performed. Call this after every
+        rotate_gears(steps) call.
+        """
+        tick = self.grid.tick
+        if tick - 1 in self.rotations:
+            # Re-simulating after a seek: the recorded data is still valid.
+            self.latest_tick = max(self.latest_tick, tick)
+            return
+
+        bitmap = rotation_bitmap(self.grid, self.grid.last_rotated)
+        self.rotations[tick - 1] = (bitmap, steps)
+        self.memory_used += self._bitmap_size(bitmap)
+        self.latest_tick = max(self.latest_tick, tick)
+
+        if tick % self.keyframe_interval == 0 and tick not in self.keyframes:
+            self._add_keyframe(tick, self.grid.get_phases())
+        self._evict()
+
+    def phases_at(self, tick):
+        """
+        Return the phases of every gear at `tick`, which must lie between earliest_tick
+        and latest_tick.
+        """
+        if not self.earliest_tick <= tick <= self.latest_tick:
+            raise ValueError(f"Tick {tick} is outside the recorded range "
+                             f"{self.earliest_tick}..{self.latest_tick}")
+
+        keyframe_tick = max(t for t in self.keyframes if t <= tick)
+        phases = self.keyframes[keyframe_tick][:]
+        num_teeth = self.grid.num_teeth
+        for t in range(keyframe_tick, tick):
+            bitmap, steps = self.rotations[t]
+            for index in iter_bits(bitmap):
+                phases[index] = (phases[index] + steps) % num_teeth
+        return phases
+
+    def restore(self, tick):
+        """
+        Put the grid back into its state at `tick`. The rotation flags are not restored;
+        run prepare_iteration() and iterate() before drawing.
+        """
+        self.grid.set_phases(self.phases_at(tick), tick=tick)
+
+    def _add_keyframe(self, tick, phases):
+        self.keyframes[tick] = phases
+        self.memory_used += len(phases) * phases.itemsize
+
+    @staticmethod
+    def _bitmap_size(bitmap):
+        return (bitmap.bit_length() + 7) // 8 + 32
+
+    def _evict(self):
+        while self.memory_used > self.memory_budget and len(self.keyframes) > 1:
+            tick, phases = self.keyframes.popitem(last=False)
+            self.memory_used -= len(phases) * phases.itemsize
+            for t in range(tick, self.earliest_tick):
+                if t in self.rotations:
+                    bitmap, _ = self.rotations.pop(t)
+                    self.memory_used -= self._bitmap_size(bitmap)
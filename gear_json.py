@@ -0,0 +1,132 @@
+"""
+Streaming reader/writer for the version 2 JSON grid format.
+
+Version 1 (the original save_grid_state output) stores a full dict for every position of
+the grid. Version 2 stores the grid-level constants once and lists only the gears that
+differ from an empty grid, one gear per line so that files diff well:
+
+    {"format": "mmg-grid", "version": 2, "rows": 10, "cols": 20, "num_layers": 4, "num_teeth": 8,
+     "columns": ["row", "col", "gear_type", "direction", "will_rotate", "layers_teeth"],
+     "gears": [
+      [1, 1, "Driver", 1, false, [128, 0, 0, 0]],
+      [1, 2, "Driven", -1, false, [17, 0, 0, 0]]
+     ]}
+
+`layers_teeth` holds one int per layer with bit k set if tooth k is present at the gear's
+current rotation. The writer puts the header keys before "gears", so the reader can work
+one gear at a time. Files rewritten by other JSON tools (e.g. with sorted keys) may put some
+header keys after the gear list; those are read whole instead.
+"""
+import json
+import re
+
+FORMAT_NAME = "mmg-grid"
+FORMAT_VERSION = 2
+COLUMNS = ["row", "col", "gear_type", "direction", "will_rotate", "layers_teeth"]
+
+# Header keys a version 2 file must have.
+HEADER_KEYS = ("format", "version", "rows", "cols", "num_layers", "num_teeth")
+
+_CHUNK_SIZE = 1 << 16
+_FORMAT_PATTERN = re.compile(r'"format"\s*:\s*"' + re.escape(FORMAT_NAME) + '"')
+
+
+def is_v2(head):
+    """
+    Return True if `head`, the first characters of a JSON grid file, is a version 2 file.
+    """
+    return _FORMAT_PATTERN.search(head) is not None
+
+
+def write_grid(f, header, gear_rows):
+    """
+    Write a version 2 grid file.
+
+    :param f:         Text file opened for writing.
+    :param header:    Dict with rows, cols, num_layers and num_teeth.
+    :param gear_rows: Iterable of lists laid out as COLUMNS.
+    """
+    fields = {"format": FORMAT_NAME, "version": FORMAT_VERSION}
+    fields.update(header)
+    fields["columns"] = COLUMNS
+    head = json.dumps(fields)
+    f.write(head[:-1] + ',\n "gears": [')
+
+    separator = "\n  "
+    for gear_row in gear_rows:
+        f.write(separator + json.dumps(gear_row))
+        separator = ",\n  "
+    f.write("\n ]}\n")
+
+
+def read_grid(f):
+    """
+    Read a version 2 grid file, incrementally when the header keys come before "gears".
+
+    :param f: Text file opened for reading, positioned at the start.
+    :return:  (header, gear_rows) where gear_rows is an iterator yielding one list per
+              gear, laid out as header["columns"].
+    """
+    buffer = ""
+    while True:
+        key_pos = buffer.find('"gears"')
+        if key_pos >= 0 and buffer.find("[", key_pos) >= 0:
+            break
+        chunk = f.read(_CHUNK_SIZE)
+        if not chunk:
+            raise ValueError("Not a version 2 grid file: no \"gears\" list found")
+        buffer += chunk
+
+    header = json.loads(buffer[:key_pos].rstrip().rstrip(",") + "}")
+    if any(key not in header for key in HEADER_KEYS):
+        # Some header keys follow the gear list: read the whole document.
+        header = json.loads(buffer + f.read())
+        gear_rows = header.pop("gears")
+        _check_header(header)
+        return header, iter(gear_rows)
+
+    _check_header(header)
+    buffer = buffer[buffer.find("[", key_pos) + 1:]
+
+    return header, _iter_gear_rows(f, buffer)
+
+
+def _check_header(header):
+    if header.get("format") != FORMAT_NAME or header.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported grid file format: {header.get('format')!r} "
+                         f"version {header.get('version')!r}")
+    missing = [key for key in HEADER_KEYS if key not in header]
+    if missing:
+        raise ValueError(f"Grid file header is missing {', '.join(missing)}")
+    header.setdefault("columns", COLUMNS)
+
+
+def _iter_gear_rows(f, buffer):
+    decoder = json.JSONDecoder()
+    pos = 0
+    eof = False
+    while True:
+        # Skip separators between gears.
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+
+        try:
+            if pos >= len(buffer):
+                raise ValueError("buffer exhausted")
+            gear_row, end = decoder.raw_decode(buffer, pos)
+            # A value ending exactly at the buffer end may be a truncated number.
+            if end == len(buffer) and not eof:
+                raise ValueError("value may continue in the next chunk")
+        except ValueError:
+            if eof:
+                raise ValueError("Truncated version 2 grid file")
+            chunk = f.read(_CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+        yield gear_row
+        pos = end
@@ -1,6 +1,23 @@
 import json
 import random
 
+import gear_json
+from array import array
+from gear_profile import profiled
+
+_MASK64 = (1 << 64) - 1
+
+
+def _zobrist_key(index):
+    """
+    Pseudo-random 64-bit key for a (gear, phase) pair, derived with splitmix64 so that no
+    key table has to be stored.
+    """
+    z = (index * 0x9E3779B97F4A7C15 + 0x2545F4914F6CDD1D) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return z ^ (z >> 31)
+
 class MultiLayerGear:
     """
     A purely logical representation of a multi-layer gear:
@@ -11,40 +28,182 @@ class MultiLayerGear:
       - gear_type:          "Driver" or "Driven" (determines if this gear forces rotation).
       - direction:          +1 or -1 (clockwise or counterclockwise).
       - will_rotate:        A flag indicating if the gear is set to rotate.
+      - phase:              Number of teeth (modulo num_teeth) the gear has turned since it
+                            was created.
+
+    Rotating a gear only increments `phase`; tooth `index` is read from the stored flags at
+    `(index - phase * direction + folded) % num_teeth`, where `folded` is the part of the
+    rotation already applied to the stored lists. Accessing `layers_teeth_flags` folds the
+    rest in so the lists can be edited in place, but leaves `phase` alone, so recorded phases
+    (see MultiLayerGearGrid.get_phases) stay valid across reads.
+
+    For contact tests the flags are also kept as one int per tooth position with one bit per
+    layer (see tooth_mask), so two gears mesh on some layer if their masks share a bit.
     """
-    def __init__(self, num_teeth, num_layers, gear_type="Driven", direction=1):
+    def __init__(self, num_teeth, num_layers, gear_type="Driven", direction=1,
+                 layers_teeth_flags=None, phase=0):
         self.num_teeth = num_teeth
         self.num_layers = num_layers
-        self.layers_teeth_flags = [[False] * num_teeth for _ in range(num_layers)]
+        if layers_teeth_flags is None:
+            layers_teeth_flags = [[False] * num_teeth for _ in range(num_layers)]
+        self._flags = layers_teeth_flags
+        self._flags_shared = False  # True while the flag lists are shared with a copy.
+        self._tooth_masks = None    # Per-tooth layer bitmasks, rebuilt after edits.
+        self.version = 0            # Bumped whenever the stored flags change.
+        self.phase = phase
+        self._folded = 0            # Part of phase * direction applied to the stored flags.
         self.gear_type = gear_type
-        self.direction = direction
+        self._direction = direction
         self.will_rotate = False
 
+    @property
+    def layers_teeth_flags(self):
+        """
+        The tooth flags at the gear's current rotation, as mutable lists.
+        """
+        self._normalise()
+        if self._flags_shared:
+            self._flags = [list(layer) for layer in self._flags]
+            self._flags_shared = False
+        # The caller may edit the lists, so the masks have to be rebuilt.
+        self._tooth_masks = None
+        self.version += 1
+        return self._flags
+
+    @layers_teeth_flags.setter
+    def layers_teeth_flags(self, flags):
+        self._flags = flags
+        self._flags_shared = False
+        self._tooth_masks = None
+        self.version += 1
+        self._folded = (self.phase * self._direction) % self.num_teeth
+
+    @property
+    def direction(self):
+        return self._direction
+
+    @direction.setter
+    def direction(self, direction):
+        # The phase is interpreted in the current direction, so fold it in first.
+        self._normalise()
+        self._direction = direction
+        self._folded = (self.phase * direction) % self.num_teeth
+        self.version += 1
+
+    def _shift(self):
+        # Number of places the stored flags still have to turn to show the current rotation.
+        return (self.phase * self._direction - self._folded) % self.num_teeth
+
+    def _normalise(self):
+        """
+        Fold the remaining rotation into the stored flag lists. The phase is kept.
+        """
+        shift = self._shift()
+        if shift:
+            self._flags = [layer[-shift:] + layer[:-shift] for layer in self._flags]
+            self._flags_shared = False
+            self._tooth_masks = None
+            self.version += 1
+        self._folded = (self.phase * self._direction) % self.num_teeth
+
+    def _phase_zero_flags(self):
+        """
+        Return the flags as the gear shows them at phase 0, sharing the stored lists when
+        nothing has been folded into them.
+        """
+        folded = self._folded
+        if folded:
+            return [layer[folded:] + layer[:folded] for layer in self._flags]
+        return self._flags
+
+    def tooth(self, layer, index):
+        """
+        Return True if tooth `index` of `layer` is present at the gear's current rotation.
+        """
+        return self._flags[layer][(index - self._shift()) % self.num_teeth]
+
+    def tooth_mask(self, index):
+        """
+        Return an int with bit `layer` set for every layer that has tooth `index` present
+        at the gear's current rotation.
+        """
+        return self._masks()[(index - self._shift()) % self.num_teeth]
+
+    def phase_masks(self, index):
+        """
+        Return the list of tooth_mask(index) values the gear shows at each phase 0..num_teeth-1.
+        """
+        masks = self._masks()
+        index += self._folded
+        return [masks[(index - phase * self._direction) % self.num_teeth]
+                for phase in range(self.num_teeth)]
+
+    def current_tooth_masks(self):
+        """
+        Return a tuple with tooth_mask(index) for every tooth index. Gears with equal tuples
+        (and the same number of layers) look the same.
+        """
+        masks = self._masks()
+        shift = self._shift()
+        if shift:
+            return tuple(masks[-shift:] + masks[:-shift])
+        return tuple(masks)
+
+    def _masks(self):
+        masks = self._tooth_masks
+        if masks is None:
+            masks = [0] * self.num_teeth
+            for layer, layer_flags in enumerate(self._flags):
+                bit = 1 << layer
+                for tooth_idx, present in enumerate(layer_flags):
+                    if present:
+                        masks[tooth_idx] |= bit
+            self._tooth_masks = masks
+        return masks
+
+    def layer_has_teeth(self, layer):
+        return True in self._flags[layer]
+
+    def has_teeth(self):
+        return any(self._masks())
+
+    def current_teeth_flags(self):
+        """
+        Return a fresh copy of the tooth flags at the gear's current rotation,
+        leaving the gear itself untouched.
+        """
+        shift = self._shift()
+        if shift:
+            return [layer[-shift:] + layer[:-shift] for layer in self._flags]
+        return [list(layer) for layer in self._flags]
+
     def rotate_layer(self, layer, steps=1):
         if 0 <= layer < self.num_layers:
+            flags = self.layers_teeth_flags
             # Rotate the list according to the gear's direction and steps.
-            self.layers_teeth_flags[layer] = (
-                self.layers_teeth_flags[layer][-self.direction * steps:] +
-                self.layers_teeth_flags[layer][:-self.direction * steps]
+            flags[layer] = (
+                flags[layer][-self._direction * steps:] +
+                flags[layer][:-self._direction * steps]
             )
 
     def rotate(self, steps=1):
-        for layer in range(self.num_layers):
-            self.rotate_layer(layer, steps)
+        # All layers turn together, so only the phase has to move.
+        self.phase = (self.phase + steps) % self.num_teeth
 
     def print_properties(self, label=""):
         print(f"{label}Gear Type: {self.gear_type}, Direction: {self.direction}")
-        for layer_idx, layer_flags in enumerate(self.layers_teeth_flags):
+        for layer_idx, layer_flags in enumerate(self.current_teeth_flags()):
             print(f"  Layer {layer_idx + 1} Flags: {layer_flags}")
 
     def copy(self):
         """
         Create a new MultiLayerGear with the same properties.
+        The flag lists are shared until either gear's flags are edited.
         """
-        new_gear = MultiLayerGear(self.num_teeth, self.num_layers, self.gear_type, self.direction)
-        # Make a shallow copy of each layer's list of booleans.
-        new_gear.layers_teeth_flags = [list(layer) for layer in self.layers_teeth_flags]
-        new_gear.will_rotate = self.will_rotate
+        new_gear = MultiLayerGear.__new__(MultiLayerGear)
+        new_gear.__dict__.update(self.__dict__)
+        new_gear._flags_shared = True
+        self._flags_shared = True
         return new_gear
 
 
@@ -54,44 +213,156 @@ class MultiLayerGearGrid:
       - Reset the rotation flags.
       - Propagate rotation flags to adjacent gears if their matching teeth are present.
       - Rotate the gears.
-      - Save/load the grid state to/from a JSON file.
+      - Save/load the grid state to/from a JSON file (see gear_json) or a binary .mmg file.
+      - Detect when the circuit enters a cycle and fast-forward through it (see advance).
+
+    Rotation flags are propagated by one of three engines, selected with `propagation`:
+      - "worklist":    visit only the neighbours of gears that were just activated, looking up
+                       each edge in a precomputed phase-pair coupling table (default).
+      - "incremental": keep the coupling graph between ticks and only re-check the edges of
+                       gears that rotated in the last rotate_gears() call. Ticks must go
+                       through prepare_iteration/iterate/rotate_gears, and gears edited
+                       between ticks must be reported with invalidate().
+      - "sweep":       repeat full-grid sweeps until nothing changes (the original engine).
+    All of them produce exactly the same rotation flags.
     """
-    def __init__(self, rows, cols, num_layers, num_teeth=8):
+    PROPAGATION_MODES = ("worklist", "incremental", "sweep")
+    max_seen_states = 1 << 20  # Cycle detection history limit, see advance().
+    profiler = None  # Set by gear_profile.Profiler.attach.
+
+    def __init__(self, rows, cols, num_layers, num_teeth=8, propagation="worklist"):
         self.rows = rows
         self.cols = cols
         self.num_layers = num_layers
         self.num_teeth = num_teeth
+        self.propagation = propagation
+        self.tick = 0  # Number of rotate_gears() calls so far.
+        self._reset_caches()
+        self._init_storage()
 
+    def _init_storage(self, populate=True):
         # Build a grid of "Driven" gears with alternating directions (+1 or -1).
         self.grid = []
-        for i in range(rows):
+        for i in range(self.rows):
             row_gears = []
-            for j in range(cols):
-                direction = ((i + j) % 2) * 2 - 1  # yields either +1 or -1.
-                gear = MultiLayerGear(
-                    num_teeth=num_teeth,
-                    num_layers=num_layers,
-                    gear_type="Driven",
-                    direction=direction
-                )
-                row_gears.append(gear)
+            for j in range(self.cols):
+                row_gears.append(self._default_gear(i, j) if populate else None)
             self.grid.append(row_gears)
 
+    def _default_gear(self, i, j):
+        """
+        Create the toothless 'Driven' gear that a new grid holds at (i, j).
+        """
+        direction = ((i + j) % 2) * 2 - 1  # yields either +1 or -1.
+        return MultiLayerGear(
+            num_teeth=self.num_teeth,
+            num_layers=self.num_layers,
+            gear_type="Driven",
+            direction=direction
+        )
+
+    def gear_at(self, i, j):
+        """
+        Return the gear at (i, j), or None if the position is outside the grid.
+        """
+        if 0 <= i < self.rows and 0 <= j < self.cols:
+            return self.grid[i][j]
+        return None
+
+    def iter_gears(self):
+        """
+        Yield (i, j, gear) for every gear stored in the grid, row by row.
+        """
+        for i, row in enumerate(self.grid):
+            for j, gear in enumerate(row):
+                yield i, j, gear
+
+    def _iter_gears_in_order(self):
+        # Like iter_gears(), but always row by row, for the formats that need that order.
+        return self.iter_gears()
+
+    def iter_region(self, row_start, row_stop, col_start, col_stop):
+        """
+        Yield (i, j, gear) for the gears with row_start <= i < row_stop and
+        col_start <= j < col_stop, row by row. The bounds are clipped to the grid.
+        """
+        row_start, col_start = max(row_start, 0), max(col_start, 0)
+        col_stop = min(col_stop, self.cols)
+        if col_stop <= col_start:
+            return
+        for i in range(row_start, min(row_stop, self.rows)):
+            for j, gear in enumerate(self.grid[i][col_start:col_stop], col_start):
+                yield i, j, gear
+
+    def _reset_caches(self):
+        # Bumped whenever phases or gears change (rotate_gears, invalidate), and the
+        # positions of the gears set to rotate by the last iterate(), a new list each time.
+        # Together they tell viewers when to redraw.
+        self.version = 0
+        self.rotating = []
+        # Phase-pair coupling tables, keyed by (axis, row, col) of the edge's top/left gear.
+        self._edge_tables = {}
+        # Positions of the gears turned by the last rotate_gears() call.
+        self.last_rotated = []
+        # Callables run as listener(grid, rotated, steps) at the end of every rotate_gears()
+        # call, e.g. gear_trace.TraceRecorder. Copies of the grid start without listeners.
+        self.rotation_listeners = []
+        # Incremental engine state: meshed edges, driver positions,
+        # gears rotating since the last iterate() and gears whose edges must be re-checked.
+        self._coupled_edges = None
+        self._drivers = []
+        self._rotating = []
+        self._dirty = set()
+        self._reset_cycle_history()
+
+    def _reset_cycle_history(self):
+        # Zobrist hash of all gear phases (None until first needed), the tick at which
+        # each hash was seen, the last tick hashed by advance(), a (tick, period, phases)
+        # cycle waiting to be confirmed and the confirmed (tick, period) cycle.
+        self._state_hash = None
+        self._seen_states = {}
+        self._last_seen_tick = None
+        self._cycle_candidate = None
+        self.cycle = None
+
+    def invalidate(self, i=None, j=None):
+        """
+        Tell the grid that gear (i, j) was edited, or that the whole grid was edited (gears
+        replaced, gear types changed) when called without a position. This keeps the
+        incremental engine correct and discards the cycle history.
+        """
+        self.version += 1
+        if i is None:
+            self._coupled_edges = None
+            self._dirty = set()
+        elif self._coupled_edges is not None:
+            self._dirty.add((i, j))
+        self._reset_cycle_history()
+
+    @profiled("prepare_iteration")
     def prepare_iteration(self):
+        if self.propagation == "incremental" and self._coupled_edges is not None:
+            # Only the gears set by the last iterate() can have their flag set.
+            for i, j in self._rotating:
+                self.gear_at(i, j).will_rotate = False
+            for i, j in self._drivers:
+                self.gear_at(i, j).will_rotate = True
+            return
+
         # Clear all rotation flags.
-        for row in self.grid:
-            for gear in row:
-                gear.will_rotate = False
+        for _, _, gear in self.iter_gears():
+            gear.will_rotate = False
 
         # Set gears of type 'Driver' to rotate.
-        for row in self.grid:
-            for gear in row:
-                if gear.gear_type == 'Driver':
-                    gear.will_rotate = True
-
-    def iterate(self):
-        updated = True
+        for _, _, gear in self.iter_gears():
+            if gear.gear_type == 'Driver':
+                gear.will_rotate = True
 
+    def _contact_positions(self):
+        """
+        Return (positions, opposite_positions, neighbor_offsets) describing which tooth
+        index of a gear faces each of its four neighbours.
+        """
         # Map logical positions (in terms of teeth indices).
         positions = {
             'top': 3 * self.num_teeth // 4,
@@ -109,45 +380,328 @@ class MultiLayerGearGrid:
         }
 
         # Map grid neighbors.
-        neighbor_map = {
-            'top': lambda i, j: (i - 1, j),
-            'bottom': lambda i, j: (i + 1, j),
-            'left': lambda i, j: (i, j - 1),
-            'right': lambda i, j: (i, j + 1)
+        neighbor_offsets = {
+            'top': (-1, 0),
+            'bottom': (1, 0),
+            'left': (0, -1),
+            'right': (0, 1)
         }
+        return positions, opposite_positions, neighbor_offsets
+
+    @profiled("iterate")
+    def iterate(self):
+        """
+        Propagate the rotation flags from the gears that are set to rotate (normally the
+        drivers set by prepare_iteration) to every gear meshed with them.
+        """
+        # Every engine returns (sweeps, edges examined, gears activated) for the profiler.
+        if self.propagation == "worklist":
+            counts = self._iterate_worklist()
+        elif self.propagation == "incremental":
+            counts = self._iterate_incremental()
+        elif self.propagation == "sweep":
+            counts = self._iterate_sweep()
+        else:
+            raise ValueError(f"Unknown propagation mode: {self.propagation!r}")
+
+        profiler = self.profiler
+        if profiler is not None:
+            sweeps, edges_examined, gears_activated = counts
+            profiler.count("propagation_sweeps", sweeps)
+            profiler.count("edges_examined", edges_examined)
+            profiler.count("gears_activated", gears_activated)
+
+    def _iterate_sweep(self):
+        """
+        Reference engine: sweep the whole grid until a sweep changes nothing.
+        A chain of length N needs about N sweeps.
+        """
+        updated = True
+        positions, opposite_positions, neighbor_offsets = self._contact_positions()
+        sweeps = edges_examined = activated = 0
 
         while updated:
             updated = False
-            for i in range(self.rows):
-                for j in range(self.cols):
-                    if self.grid[i][j].will_rotate:
-                        for layer in range(self.num_layers):
-                            for position, neighbor_teeth_index in positions.items():
-                                if not self.grid[i][j].layers_teeth_flags[layer][neighbor_teeth_index]:
-                                    continue
-
-                                ni, nj = neighbor_map[position](i, j)
-                                if 0 <= ni < self.rows and 0 <= nj < self.cols:
-                                    opposite_teeth_index = positions[opposite_positions[position]]
-                                    if self.grid[ni][nj].layers_teeth_flags[layer][opposite_teeth_index]:
-                                        if not self.grid[ni][nj].will_rotate:
-                                            self.grid[ni][nj].will_rotate = True
-                                            updated = True
+            sweeps += 1
+            for i, j, gear in list(self.iter_gears()):
+                if gear.will_rotate:
+                    edges_examined += 4
+                    for layer in range(self.num_layers):
+                        for position, neighbor_teeth_index in positions.items():
+                            if not gear.tooth(layer, neighbor_teeth_index):
+                                continue
+
+                            di, dj = neighbor_offsets[position]
+                            neighbor = self.gear_at(i + di, j + dj)
+                            if neighbor is not None:
+                                opposite_teeth_index = positions[opposite_positions[position]]
+                                if neighbor.tooth(layer, opposite_teeth_index):
+                                    if not neighbor.will_rotate:
+                                        neighbor.will_rotate = True
+                                        activated += 1
+                                        updated = True
+        self.rotating = [(i, j) for i, j, gear in self.iter_gears() if gear.will_rotate]
+        return sweeps, edges_examined, activated
+
+    def _iterate_worklist(self):
+        """
+        Frontier engine: start from the gears already set to rotate and only visit the
+        neighbours of gears that were just activated. Every gear is expanded at most once,
+        so the cost is linear in the number of rotating gears.
+        """
+        gear_at = self.gear_at
+        # Gears are appended while the list is walked, so it ends up holding every gear
+        # that was expanded.
+        frontier = [(i, j) for i, j, gear in self.iter_gears() if gear.will_rotate]
+        initial = len(frontier)
+
+        for i, j in frontier:
+            gear = gear_at(i, j)
+            # Each edge is keyed by its top/left gear: (neighbour, axis, edge row, edge col).
+            for ni, nj, axis, ei, ej in ((i, j + 1, 0, i, j), (i, j - 1, 0, i, j - 1),
+                                         (i + 1, j, 1, i, j), (i - 1, j, 1, i - 1, j)):
+                neighbor = gear_at(ni, nj)
+                if neighbor is None or neighbor.will_rotate:
+                    continue
+                if ei == i and ej == j:
+                    first, second = gear, neighbor
+                else:
+                    first, second = neighbor, gear
+                if (self._edge_table(axis, ei, ej, first, second)[first.phase] >> second.phase) & 1:
+                    neighbor.will_rotate = True
+                    frontier.append((ni, nj))
+        self.rotating = frontier
+        return 1, 4 * len(frontier), len(frontier) - initial
+
+    def _iterate_incremental(self):
+        """
+        Incremental engine: update the remembered coupling graph around the gears that
+        rotated (or were invalidated) since the last tick, then collect everything reachable
+        from the drivers. The cost follows the number of moving gears, not the grid area.
+        """
+        gear_at = self.gear_at
+        coupled = self._coupled_edges
+        if coupled is None:
+            coupled = self._build_coupled_edges()
+            edges_examined = 2 * self.rows * self.cols
+        else:
+            edges = set()
+            for i, j in self._dirty:
+                edges.add((0, i, j))
+                edges.add((0, i, j - 1))
+                edges.add((1, i, j))
+                edges.add((1, i - 1, j))
+            for edge in edges:
+                axis, i, j = edge
+                first, second = gear_at(i, j), gear_at(i + axis, j + 1 - axis)
+                if first is None or second is None:
+                    coupled.discard(edge)
+                elif (self._edge_table(axis, i, j, first, second)[first.phase] >> second.phase) & 1:
+                    coupled.add(edge)
+                else:
+                    coupled.discard(edge)
+            edges_examined = len(edges)
+        self._dirty = set()
 
+        reached = set(self._drivers)
+        frontier = list(self._drivers)
+        for i, j in frontier:
+            for edge, neighbor in (((0, i, j), (i, j + 1)), ((0, i, j - 1), (i, j - 1)),
+                                   ((1, i, j), (i + 1, j)), ((1, i - 1, j), (i - 1, j))):
+                if edge in coupled and neighbor not in reached:
+                    reached.add(neighbor)
+                    frontier.append(neighbor)
+
+        for i, j in frontier:
+            gear_at(i, j).will_rotate = True
+        self._rotating = self.rotating = frontier
+        return 1, edges_examined, len(frontier) - len(self._drivers)
+
+    def _build_coupled_edges(self):
+        """
+        Build the incremental engine's set of meshed edges and its driver list from scratch.
+        Edges are keyed like the coupling tables, by (axis, row, col) of their top/left gear.
+        """
+        positions, _, _ = self._contact_positions()
+        coupled = set()
+        self._drivers = []
+        for i, j, gear in self.iter_gears():
+            if gear.gear_type == 'Driver':
+                self._drivers.append((i, j))
+            right = self.gear_at(i, j + 1)
+            if right is not None and gear.tooth_mask(positions['right']) & right.tooth_mask(positions['left']):
+                coupled.add((0, i, j))
+            below = self.gear_at(i + 1, j)
+            if below is not None and gear.tooth_mask(positions['bottom']) & below.tooth_mask(positions['top']):
+                coupled.add((1, i, j))
+        self._coupled_edges = coupled
+        return coupled
+
+    def _edge_table(self, axis, i, j, first, second):
+        """
+        Return the phase-pair coupling table of the edge between gear (i, j) and its right
+        (axis 0) or bottom (axis 1) neighbour. Bit `pb` of table[pa] is set if the two gears
+        mesh on some layer when `first` is at phase pa and `second` at phase pb.
+
+        Tables are built on first use and rebuilt whenever either gear's flags were edited
+        since (tracked through MultiLayerGear.version).
+        """
+        key = (axis, i, j)
+        entry = self._edge_tables.get(key)
+        if (entry is None or entry[0] is not first or entry[1] != first.version or
+                entry[2] is not second or entry[3] != second.version):
+            positions, opposite_positions, _ = self._contact_positions()
+            position = 'right' if axis == 0 else 'bottom'
+            first_masks = first.phase_masks(positions[position])
+            second_masks = second.phase_masks(positions[opposite_positions[position]])
+            table = []
+            for first_mask in first_masks:
+                row = 0
+                if first_mask:
+                    for phase, second_mask in enumerate(second_masks):
+                        if first_mask & second_mask:
+                            row |= 1 << phase
+                table.append(row)
+            entry = (first, first.version, second, second.version, table)
+            self._edge_tables[key] = entry
+        return entry[4]
+
+    @profiled("rotate_gears", ends_tick=True)
     def rotate_gears(self, steps=1):
-        for row in self.grid:
-            for gear in row:
-                if gear.will_rotate:
-                    gear.rotate(steps=steps)
+        if self.propagation == "incremental" and self._coupled_edges is not None:
+            rotated = [(i, j) for i, j in self._rotating if self.gear_at(i, j).will_rotate]
+        else:
+            rotated = [(i, j) for i, j, gear in self.iter_gears() if gear.will_rotate]
+
+        state_hash = self._state_hash
+        for i, j in rotated:
+            gear = self.gear_at(i, j)
+            if state_hash is not None:
+                index = i * self.cols + j
+                state_hash ^= self._phase_key(index, gear.phase)
+                gear.rotate(steps=steps)
+                state_hash ^= self._phase_key(index, gear.phase)
+            else:
+                gear.rotate(steps=steps)
+        self._state_hash = state_hash
+        self.last_rotated = rotated
+        self.tick += 1
+        self.version += 1
+
+        if self._coupled_edges is not None:
+            self._dirty.update(rotated)
+        for listener in self.rotation_listeners:
+            listener(self, rotated, steps)
+        if self.profiler is not None:
+            self.profiler.count("gears_rotated", len(rotated))
+
+    def step(self):
+        """
+        Run one full tick: prepare_iteration, iterate and rotate_gears.
+        """
+        self.prepare_iteration()
+        self.iterate()
+        self.rotate_gears()
+
+    # Cycle detection
+
+    def get_phases(self):
+        """
+        Return the phase of every grid position, row by row, as a compact array.
+        """
+        phases = array('B' if self.num_teeth <= 256 else 'H', bytes(self.rows * self.cols))
+        for i, j, gear in self.iter_gears():
+            phases[i * self.cols + j] = gear.phase
+        return phases
+
+    def set_phases(self, phases, tick=None):
+        """
+        Inverse of get_phases: turn every gear to the given phase, e.g. to rewind the grid
+        to a recorded state (see gear_history). The rotation flags are left as they are;
+        run prepare_iteration() and iterate() before rotating or drawing.
+        """
+        for i, j, gear in self.iter_gears():
+            gear.phase = phases[i * self.cols + j]
+        if tick is not None:
+            self.tick = tick
+        self.last_rotated = []
+        self.invalidate()
+
+    def _phase_key(self, index, phase):
+        # Phase 0 contributes nothing, so gears that never turned can be skipped.
+        return _zobrist_key(index * self.num_teeth + phase) if phase else 0
+
+    def state_hash(self):
+        """
+        Return the Zobrist hash of all gear phases. It is computed once and then updated
+        by rotate_gears() for the gears that turned.
+        """
+        if self._state_hash is None:
+            state_hash = 0
+            for i, j, gear in self.iter_gears():
+                state_hash ^= self._phase_key(i * self.cols + j, gear.phase)
+            self._state_hash = state_hash
+        return self._state_hash
+
+    def advance(self, n):
+        """
+        Run `n` ticks. The phases are hashed every tick; once the circuit is found to repeat
+        with some period, the remaining ticks are skipped modulo that period, so reaching a
+        tick far in the future costs about one period of simulation.
+
+        A repeated hash is only trusted after the phases are seen to match one period later,
+        so hash collisions cannot produce a wrong state. At most `max_seen_states` hashes are
+        kept; cycles longer than that are simulated tick by tick.
+        """
+        target = self.tick + n
+        if self._last_seen_tick is not None and self.tick != self._last_seen_tick + 1:
+            # Ticks were run outside advance() since the last call: start the history again.
+            self._seen_states = {}
+            self._cycle_candidate = None
+        while self.tick < target:
+            if self.cycle is not None:
+                _, period = self.cycle
+                for _ in range((target - self.tick) % period):
+                    self.step()
+                self.tick = target
+                break
+
+            state_hash = self.state_hash()
+            if self._cycle_candidate is not None:
+                candidate_tick, period, phases = self._cycle_candidate
+                if self.tick == candidate_tick + period:
+                    if self.get_phases() == phases:
+                        self.cycle = (self.tick, period)
+                        continue
+                    self._cycle_candidate = None
+            elif state_hash in self._seen_states:
+                period = self.tick - self._seen_states[state_hash]
+                self._cycle_candidate = (self.tick, period, self.get_phases())
+            if len(self._seen_states) >= self.max_seen_states:
+                self._seen_states = {}
+            self._seen_states[state_hash] = self.tick
+            self._last_seen_tick = self.tick
+            self.step()
 
     def print_grid_properties(self):
-        for i, row in enumerate(self.grid):
-            for j, gear in enumerate(row):
-                gear.print_properties(label=f"[{i},{j}] ")
+        for i, j, gear in self.iter_gears():
+            gear.print_properties(label=f"[{i},{j}] ")
 
     # Saving / Loading State
 
-    def save_grid_state(self, filename):
+    def save_grid_state(self, filename, json_version=2):
+        """
+        Save the grid to `filename`: binary .mmg if the name ends with ".mmg"
+        (see gear_format), JSON otherwise. `json_version` selects the compact streaming
+        layout (2, see gear_json) or the original one-dict-per-gear layout (1).
+        """
+        if filename.endswith(".mmg"):
+            self._save_mmg(filename)
+            return
+        if json_version == 2:
+            self._save_json_v2(filename)
+            return
+
         data = {
             "rows": self.rows,
             "cols": self.cols,
@@ -158,11 +712,11 @@ class MultiLayerGearGrid:
         for i in range(self.rows):
             row_data = []
             for j in range(self.cols):
-                gear = self.grid[i][j]
+                gear = self.gear_at(i, j) or self._default_gear(i, j)
                 gear_info = {
                     "num_teeth": gear.num_teeth,
                     "num_layers": gear.num_layers,
-                    "layers_teeth_flags": gear.layers_teeth_flags,
+                    "layers_teeth_flags": gear.current_teeth_flags(),
                     "gear_type": gear.gear_type,
                     "direction": gear.direction,
                     "will_rotate": gear.will_rotate
@@ -175,36 +729,323 @@ class MultiLayerGearGrid:
 
     @classmethod
     def load_grid_state(cls, filename):
+        """
+        Load a grid saved by save_grid_state, as .mmg or JSON depending on the file name.
+        JSON files are told apart by their "format" key (version 2, see gear_json) or their
+        "grid" key (version 1).
+        """
+        if filename.endswith(".mmg"):
+            return cls._load_mmg(filename)
+
         with open(filename, "r") as f:
+            if gear_json.is_v2(f.read(4096)):
+                f.seek(0)
+                return cls._load_json_v2(f)
+            f.seek(0)
             data = json.load(f)
+        if not isinstance(data, dict) or "grid" not in data:
+            raise ValueError(f"{filename} is not a grid file: it has neither a version 2 "
+                             f"\"format\" header nor a \"grid\" list")
 
-        grid_obj = cls(
-            rows=data["rows"],
-            cols=data["cols"],
-            num_layers=data["num_layers"],
-            num_teeth=data["num_teeth"]
-        )
-
-        for i in range(data["rows"]):
-            for j in range(data["cols"]):
-                gear_data = data["grid"][i][j]
-                gear = grid_obj.grid[i][j]
-                gear.num_teeth = gear_data["num_teeth"]
-                gear.num_layers = gear_data["num_layers"]
-                gear.layers_teeth_flags = gear_data["layers_teeth_flags"]
-                gear.gear_type = gear_data["gear_type"]
-                gear.direction = gear_data["direction"]
+        grid_obj = cls._without_gears(data["rows"], data["cols"], data["num_layers"], data["num_teeth"])
+        for i, row_data in enumerate(data["grid"]):
+            for j, gear_data in enumerate(row_data):
+                gear = MultiLayerGear(
+                    num_teeth=gear_data["num_teeth"],
+                    num_layers=gear_data["num_layers"],
+                    gear_type=gear_data["gear_type"],
+                    direction=gear_data["direction"],
+                    layers_teeth_flags=gear_data["layers_teeth_flags"]
+                )
                 gear.will_rotate = gear_data["will_rotate"]
+                grid_obj._store_loaded_gear(i, j, gear)
+
+        return grid_obj
+
+    def _save_json_v2(self, filename):
+        def gear_rows():
+            for i, j, gear in self._iter_gears_in_order():
+                if self._is_default_gear(i, j, gear, ignore_phase=True):
+                    continue
+                layers_teeth = [
+                    sum(1 << k for k, present in enumerate(layer_flags) if present)
+                    for layer_flags in gear.current_teeth_flags()
+                ]
+                yield [i, j, gear.gear_type, gear.direction, gear.will_rotate, layers_teeth]
+
+        header = {
+            "rows": self.rows,
+            "cols": self.cols,
+            "num_layers": self.num_layers,
+            "num_teeth": self.num_teeth
+        }
+        with open(filename, "w") as f:
+            gear_json.write_grid(f, header, gear_rows())
+
+    @classmethod
+    def _load_json_v2(cls, f):
+        header, gear_rows = gear_json.read_grid(f)
+        num_layers = header["num_layers"]
+        num_teeth = header["num_teeth"]
+        column = {name: index for index, name in enumerate(header["columns"])}
+
+        # Positions that are not listed hold the default gear.
+        grid_obj = cls._without_gears(header["rows"], header["cols"], num_layers, num_teeth,
+                                      populate=True)
+        for gear_row in gear_rows:
+            gear = MultiLayerGear(
+                num_teeth=num_teeth,
+                num_layers=num_layers,
+                gear_type=gear_row[column["gear_type"]],
+                direction=gear_row[column["direction"]],
+                layers_teeth_flags=[
+                    [bool((layer_teeth >> k) & 1) for k in range(num_teeth)]
+                    for layer_teeth in gear_row[column["layers_teeth"]]
+                ]
+            )
+            gear.will_rotate = gear_row[column["will_rotate"]]
+            grid_obj._store_loaded_gear(gear_row[column["row"]], gear_row[column["col"]], gear)
+        return grid_obj
+
+    @classmethod
+    def _without_gears(cls, rows, cols, num_layers, num_teeth, populate=False):
+        """
+        Create a grid whose positions hold None (or default gears with `populate`), for
+        loaders that build the gears themselves.
+        """
+        grid_obj = cls.__new__(cls)
+        grid_obj.rows = rows
+        grid_obj.cols = cols
+        grid_obj.num_layers = num_layers
+        grid_obj.num_teeth = num_teeth
+        grid_obj.propagation = "worklist"
+        grid_obj.tick = 0
+        grid_obj._reset_caches()
+        grid_obj._init_storage(populate=populate)
+        return grid_obj
+
+    def _store_loaded_gear(self, i, j, gear):
+        self.grid[i][j] = gear
+
+    def _is_default_gear(self, i, j, gear, ignore_phase=False):
+        """
+        Return True if `gear` is indistinguishable from the gear a new grid holds at (i, j).
+        """
+        return (gear.gear_type != 'Driver' and not gear.will_rotate and
+                (ignore_phase or gear.phase == 0) and
+                gear.direction == ((i + j) % 2) * 2 - 1 and not gear.has_teeth())
 
+    def _save_mmg(self, filename):
+        import numpy as np
+        import gear_format
+
+        # The flags are written at phase 0 alongside the phases, without normalising.
+        gears = list(self.iter_gears())
+        ii = np.array([i for i, _, _ in gears], dtype=np.intp)
+        jj = np.array([j for _, j, _ in gears], dtype=np.intp)
+        flags = np.array([gear._phase_zero_flags() for _, _, gear in gears], dtype=bool)
+        flags = flags.reshape(len(gears), self.num_layers, self.num_teeth)
+
+        shape = (self.rows, self.cols)
+        teeth = np.zeros((self.num_layers,) + shape, dtype=gear_format.teeth_dtype(self.num_teeth))
+        teeth[:, ii, jj] = gear_format.pack_teeth(flags, self.num_teeth).T
+        rows_idx, cols_idx = np.indices(shape)
+        direction = (((rows_idx + cols_idx) % 2) * 2 - 1).astype(np.int8)
+        direction[ii, jj] = [gear.direction for _, _, gear in gears]
+        gear_type = np.zeros(shape, dtype=np.uint8)
+        gear_type[ii, jj] = [gear.gear_type == 'Driver' for _, _, gear in gears]
+        phase = np.zeros(shape, dtype=np.int64)
+        phase[ii, jj] = [gear.phase for _, _, gear in gears]
+        will_rotate = np.zeros(shape, dtype=np.uint8)
+        will_rotate[ii, jj] = [gear.will_rotate for _, _, gear in gears]
+
+        planes = {
+            "teeth": teeth,
+            "gear_type": gear_type,
+            "direction": direction,
+            "phase": phase,
+            "will_rotate": will_rotate,
+        }
+        gear_format.write_mmg(filename, self.rows, self.cols, self.num_layers, self.num_teeth, planes)
+
+    @classmethod
+    def _load_mmg(cls, filename):
+        import gear_format
+
+        rows, cols, num_layers, num_teeth, planes = gear_format.read_mmg(filename)
+        flags = gear_format.unpack_teeth(planes["teeth"], num_teeth).transpose(1, 2, 0, 3).tolist()
+        gear_type = planes["gear_type"].tolist()
+        direction = planes["direction"].tolist()
+        phase = planes["phase"].tolist()
+        will_rotate = planes["will_rotate"].tolist()
+
+        grid_obj = cls._without_gears(rows, cols, num_layers, num_teeth)
+        for i in range(rows):
+            for j in range(cols):
+                gear = MultiLayerGear(
+                    num_teeth=num_teeth,
+                    num_layers=num_layers,
+                    gear_type='Driver' if gear_type[i][j] else 'Driven',
+                    direction=direction[i][j],
+                    layers_teeth_flags=flags[i][j],
+                    phase=phase[i][j]
+                )
+                gear.will_rotate = bool(will_rotate[i][j])
+                grid_obj._store_loaded_gear(i, j, gear)
         return grid_obj
 
     def copy(self):
         """
         Create a new MultiLayerGearGrid that is a copy of the current grid.
         """
-        new_grid = MultiLayerGearGrid(self.rows, self.cols, self.num_layers, self.num_teeth)
-        for i in range(self.rows):
-            for j in range(self.cols):
-                new_grid.grid[i][j] = self.grid[i][j].copy()
+        # Skip the constructor so the default gears are not built only to be replaced.
+        new_grid = self.__class__.__new__(self.__class__)
+        new_grid.__dict__.update(self.__dict__)
+        new_grid.grid = [[gear.copy() for gear in row] for row in self.grid]
+        new_grid._reset_caches()
         return new_grid
 
+
+
+class _SparseRow:
+    """
+    Row view of a SparseGearGrid, so that `grid.grid[i][j]` keeps working. Reading a
+    position that holds no gear stores a new default gear there, since callers such as
+    grid_editor.add_data_to_grid edit the gear they get back.
+    """
+    def __init__(self, gear_grid, i):
+        self.gear_grid = gear_grid
+        self.i = i
+
+    def _index(self, j):
+        if j < 0:
+            j += self.gear_grid.cols
+        if not 0 <= j < self.gear_grid.cols:
+            raise IndexError("gear grid column index out of range")
+        return j
+
+    def __getitem__(self, j):
+        j = self._index(j)
+        gears = self.gear_grid.gears
+        gear = gears.get((self.i, j))
+        if gear is None:
+            gear = self.gear_grid._default_gear(self.i, j)
+            gears[(self.i, j)] = gear
+            self.gear_grid._needs_compact = True
+        return gear
+
+    def __setitem__(self, j, gear):
+        self.gear_grid.gears[(self.i, self._index(j))] = gear
+
+    def __len__(self):
+        return self.gear_grid.cols
+
+    def __iter__(self):
+        for j in range(self.gear_grid.cols):
+            yield self[j]
+
+
+class _SparseRows:
+    def __init__(self, gear_grid):
+        self.gear_grid = gear_grid
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.gear_grid.rows
+        if not 0 <= i < self.gear_grid.rows:
+            raise IndexError("gear grid row index out of range")
+        return _SparseRow(self.gear_grid, i)
+
+    def __len__(self):
+        return self.gear_grid.rows
+
+    def __iter__(self):
+        for i in range(self.gear_grid.rows):
+            yield self[i]
+
+
+class SparseGearGrid(MultiLayerGearGrid):
+    """
+    A MultiLayerGearGrid that only stores populated gears, in the dict `gears` keyed by
+    (row, col). Positions without an entry behave like a new grid's toothless 'Driven'
+    gear: they can never mesh, so the engines, rotate_gears(), copy() and the visualizer
+    skip them, and memory and tick time follow the circuit size instead of the grid area.
+
+    `grid.grid[i][j]` still returns a gear that can be edited in place. Gears that end up
+    empty again are dropped by compact(), which prepare_iteration() runs when needed.
+    Iterating over `grid.grid` visits every position and so stores a gear at each of them;
+    use iter_gears() instead.
+    """
+    def _init_storage(self, populate=True):
+        self.gears = {}
+        self.grid = _SparseRows(self)
+        self._needs_compact = False
+
+    def gear_at(self, i, j):
+        return self.gears.get((i, j))
+
+    def iter_gears(self):
+        for (i, j), gear in self.gears.items():
+            yield i, j, gear
+
+    def _iter_gears_in_order(self):
+        gears = self.gears
+        for i, j in sorted(gears):
+            yield i, j, gears[(i, j)]
+
+    def iter_region(self, row_start, row_stop, col_start, col_stop):
+        row_start, col_start = max(row_start, 0), max(col_start, 0)
+        row_stop, col_stop = min(row_stop, self.rows), min(col_stop, self.cols)
+        area = max(row_stop - row_start, 0) * max(col_stop - col_start, 0)
+        if area < len(self.gears):
+            # Small region: look up its positions.
+            gears = self.gears
+            for i in range(row_start, row_stop):
+                for j in range(col_start, col_stop):
+                    gear = gears.get((i, j))
+                    if gear is not None:
+                        yield i, j, gear
+        else:
+            for (i, j), gear in self.gears.items():
+                if row_start <= i < row_stop and col_start <= j < col_stop:
+                    yield i, j, gear
+
+    def _store_loaded_gear(self, i, j, gear):
+        if not self._is_default_gear(i, j, gear):
+            self.gears[(i, j)] = gear
+
+    def compact(self):
+        """
+        Drop the stored gears that are indistinguishable from an empty position.
+        """
+        self.gears = {
+            position: gear
+            for position, gear in self.gears.items()
+            if not self._is_default_gear(position[0], position[1], gear)
+        }
+        self._needs_compact = False
+
+    def prepare_iteration(self):
+        if self._needs_compact:
+            self.compact()
+        super().prepare_iteration()
+
+    @classmethod
+    def from_grid(cls, grid):
+        """
+        Build a SparseGearGrid sharing nothing with `grid` but holding the same gears.
+        """
+        sparse = cls._without_gears(grid.rows, grid.cols, grid.num_layers, grid.num_teeth)
+        sparse.propagation = grid.propagation
+        sparse.tick = grid.tick
+        for i, j, gear in grid.iter_gears():
+            sparse._store_loaded_gear(i, j, gear.copy())
+        return sparse
+
+    def copy(self):
+        new_grid = self.__class__.__new__(self.__class__)
+        new_grid.__dict__.update(self.__dict__)
+        new_grid._init_storage()
+        new_grid.gears = {position: gear.copy() for position, gear in self.gears.items()}
+        new_grid._reset_caches()
+        return new_grid
@@ -0,0 +1,341 @@
+import numpy as np
+
+import gear_format
+from gear_format import teeth_dtype
+from gear_logic import MultiLayerGearGrid
+from gear_profile import profiled
+
+
+def _rotate_teeth(teeth, shift, num_teeth):
+    """
+    Bit-rotate packed teeth left by `shift` (an array broadcastable to `teeth`, with values
+    in 0..num_teeth-1), so that tooth k moves to k + shift.
+    """
+    dtype = teeth.dtype
+    full = dtype.type((1 << num_teeth) - 1)
+    shift = shift.astype(dtype)
+    rotated = ((teeth << shift) | (teeth >> (dtype.type(num_teeth) - shift))) & full
+    return np.where(shift == 0, teeth, rotated)
+
+
+def _fill_runs(active, links):
+    """
+    Spread activation along the last axis of `active` through chains of linked cells.
+
+    :param active: Boolean array (..., N).
+    :param links:  Boolean array (..., N - 1); links[..., k] connects cell k with cell k + 1.
+    :return:       Boolean array (..., N) where every cell of a linked run is active if
+                   any cell of that run was active.
+    """
+    shape = active.shape
+    n = shape[-1]
+    if active.size == 0:
+        return active.copy()
+
+    flat_active = np.ascontiguousarray(active).reshape(-1, n)
+    starts = np.ones(flat_active.shape, dtype=bool)
+    starts[:, 1:] = ~links.reshape(flat_active.shape[0], n - 1)
+
+    run_starts = np.flatnonzero(starts.ravel())
+    run_active = np.logical_or.reduceat(flat_active.ravel(), run_starts)
+    run_lengths = np.diff(np.append(run_starts, flat_active.size))
+    return np.repeat(run_active, run_lengths).reshape(shape)
+
+
+class NumpyGearGrid:
+    """
+    An array-backed alternative to MultiLayerGearGrid with the same tick API.
+
+    The whole grid is held as packed bit planes:
+      - teeth:       (num_layers, rows, cols) unsigned ints, bit k set if tooth k is present.
+      - driver:      (rows, cols) bool, True for 'Driver' gears.
+      - direction:   (rows, cols) int8, +1 or -1.
+      - will_rotate: (rows, cols) bool.
+
+    Contact tests become shifted array ANDs, propagation fills whole runs of meshed gears
+    per pass, and rotation is a masked bit-rotate. All array code indexes from the right,
+    so any leading batch axes are carried along unchanged.
+    """
+    profiler = None  # Set by gear_profile.Profiler.attach.
+
+    def __init__(self, rows, cols, num_layers, num_teeth=8):
+        self.rows = rows
+        self.cols = cols
+        self.num_layers = num_layers
+        self.num_teeth = num_teeth
+
+        self.teeth = np.zeros((num_layers, rows, cols), dtype=teeth_dtype(num_teeth))
+        self.driver = np.zeros((rows, cols), dtype=bool)
+        ii, jj = np.indices((rows, cols))
+        self.direction = (((ii + jj) % 2) * 2 - 1).astype(np.int8)  # yields either +1 or -1.
+        self.will_rotate = np.zeros((rows, cols), dtype=bool)
+
+    # Conversion to / from the object grid
+
+    @classmethod
+    def from_grid(cls, grid):
+        """
+        Build a NumpyGearGrid holding the same state as a MultiLayerGearGrid.
+        """
+        np_grid = cls(grid.rows, grid.cols, grid.num_layers, grid.num_teeth)
+        gears = list(grid.iter_gears())
+        if not gears:
+            return np_grid
+
+        ii = np.array([i for i, _, _ in gears], dtype=np.intp)
+        jj = np.array([j for _, j, _ in gears], dtype=np.intp)
+        flags = np.array([gear.current_teeth_flags() for _, _, gear in gears], dtype=bool)
+        flags = flags.reshape(len(gears), grid.num_layers, grid.num_teeth)
+        np_grid.teeth[:, ii, jj] = gear_format.pack_teeth(flags, grid.num_teeth).T
+
+        np_grid.driver[ii, jj] = [gear.gear_type == 'Driver' for _, _, gear in gears]
+        np_grid.direction[ii, jj] = [gear.direction for _, _, gear in gears]
+        np_grid.will_rotate[ii, jj] = [gear.will_rotate for _, _, gear in gears]
+        return np_grid
+
+    def to_grid(self):
+        """
+        Build a MultiLayerGearGrid holding the same state as this grid.
+        """
+        grid = MultiLayerGearGrid(self.rows, self.cols, self.num_layers, self.num_teeth)
+        bits = np.arange(self.num_teeth, dtype=self.teeth.dtype)
+        flags = ((self.teeth[..., None] >> bits) & 1).astype(bool).transpose(1, 2, 0, 3).tolist()
+        driver = self.driver.tolist()
+        direction = self.direction.tolist()
+        will_rotate = self.will_rotate.tolist()
+        for i in range(self.rows):
+            for j in range(self.cols):
+                gear = grid.grid[i][j]
+                gear.layers_teeth_flags = flags[i][j]
+                gear.gear_type = 'Driver' if driver[i][j] else 'Driven'
+                gear.direction = direction[i][j]
+                gear.will_rotate = will_rotate[i][j]
+        return grid
+
+    # Simulation
+
+    def _tooth_bits(self, index):
+        """
+        Return a boolean array (..., layers, rows, cols) of the tooth at `index`.
+        """
+        return ((self.teeth >> self.teeth.dtype.type(index)) & 1).astype(bool)
+
+    def couplings(self):
+        """
+        Return (horizontal, vertical) boolean arrays of meshed neighbour pairs:
+          - horizontal[..., i, j] is True if gear (i, j) meshes with (i, j + 1) on any layer.
+          - vertical[..., i, j] is True if gear (i, j) meshes with (i + 1, j) on any layer.
+        """
+        right = self._tooth_bits(0)
+        left = self._tooth_bits(self.num_teeth // 2)
+        bottom = self._tooth_bits(self.num_teeth // 4)
+        top = self._tooth_bits(3 * self.num_teeth // 4)
+
+        horizontal = (right[..., :, :-1] & left[..., :, 1:]).any(axis=-3)
+        vertical = (bottom[..., :-1, :] & top[..., 1:, :]).any(axis=-3)
+        return horizontal, vertical
+
+    @profiled("prepare_iteration")
+    def prepare_iteration(self):
+        # Only the drivers start out rotating.
+        self.will_rotate = self.driver.copy()
+
+    @profiled("iterate")
+    def iterate(self):
+        """
+        Propagate the rotation flags until no more gears are activated. Each pass fills
+        every horizontal run and then every vertical run of meshed gears at once, so the
+        number of passes follows the number of turns in a chain, not its length.
+        """
+        horizontal, vertical = self.couplings()
+        active = self.will_rotate
+        sweeps = 0
+        while True:
+            sweeps += 1
+            updated = _fill_runs(active, horizontal)
+            updated = np.swapaxes(
+                _fill_runs(np.swapaxes(updated, -1, -2), np.swapaxes(vertical, -1, -2)),
+                -1, -2
+            )
+            if np.array_equal(updated, active):
+                break
+            active = updated
+
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.count("propagation_sweeps", sweeps)
+            profiler.count("edges_examined", sweeps * (horizontal.size + vertical.size))
+            profiler.count("gears_activated",
+                           int(np.count_nonzero(active)) - int(np.count_nonzero(self.will_rotate)))
+        self.will_rotate = np.ascontiguousarray(active)
+
+    @profiled("rotate_gears", ends_tick=True)
+    def rotate_gears(self, steps=1):
+        """
+        Rotate every gear flagged to rotate by `steps` teeth in its own direction.
+        """
+        # A rotation by +1 moves tooth k to k + 1, i.e. a left bit-rotate.
+        shift = (self.direction.astype(np.int64) * steps) % self.num_teeth
+        rotated = _rotate_teeth(self.teeth, shift, self.num_teeth)
+        self.teeth = np.where(self.will_rotate[..., None, :, :], rotated, self.teeth)
+        if self.profiler is not None:
+            self.profiler.count("gears_rotated", int(np.count_nonzero(self.will_rotate)))
+
+    def step(self):
+        """
+        Run one full tick: prepare_iteration, iterate and rotate_gears.
+        """
+        self.prepare_iteration()
+        self.iterate()
+        self.rotate_gears()
+
+    def copy(self):
+        new_grid = self.__class__.__new__(self.__class__)
+        new_grid.__dict__.update(self.__dict__)
+        new_grid.teeth = self.teeth.copy()
+        new_grid.driver = self.driver.copy()
+        new_grid.direction = self.direction.copy()
+        new_grid.will_rotate = self.will_rotate.copy()
+        return new_grid
+
+    # Saving / Loading State
+
+    def save_grid_state(self, filename):
+        """
+        Save the grid as .mmg (written straight from the arrays) or, for any other
+        file name, as JSON through MultiLayerGearGrid.
+        """
+        if not filename.endswith(".mmg"):
+            self.to_grid().save_grid_state(filename)
+            return
+
+        planes = {
+            "teeth": self.teeth,
+            "gear_type": self.driver,
+            "direction": self.direction,
+            "phase": np.zeros((self.rows, self.cols), dtype=np.uint8),
+            "will_rotate": self.will_rotate,
+        }
+        gear_format.write_mmg(filename, self.rows, self.cols, self.num_layers, self.num_teeth, planes)
+
+    @classmethod
+    def load_grid_state(cls, filename):
+        """
+        Load a grid saved by save_grid_state. A .mmg file is memory-mapped copy-on-write,
+        so the planes are not read until they are used.
+        """
+        if not filename.endswith(".mmg"):
+            return cls.from_grid(MultiLayerGearGrid.load_grid_state(filename))
+
+        rows, cols, num_layers, num_teeth, planes = gear_format.read_mmg(filename)
+        np_grid = cls.__new__(cls)
+        np_grid.rows = rows
+        np_grid.cols = cols
+        np_grid.num_layers = num_layers
+        np_grid.num_teeth = num_teeth
+        np_grid.teeth = planes["teeth"]
+        np_grid.driver = planes["gear_type"].view(bool)
+        np_grid.direction = planes["direction"]
+        np_grid.will_rotate = planes["will_rotate"].view(bool)
+
+        # Files written from MultiLayerGearGrid keep per-gear phases; apply them here.
+        phase = planes["phase"]
+        if phase.any():
+            shift = (phase.astype(np.int64) * np_grid.direction) % num_teeth
+            np_grid.teeth = _rotate_teeth(np_grid.teeth, shift, num_teeth)
+        return np_grid
+
+
+class BatchedGearGrid(NumpyGearGrid):
+    """
+    B independent variants of one grid layout simulated in lockstep.
+
+    The variants share rows, cols, layers, teeth count and gear directions, but each has its
+    own teeth, drivers and rotation state, stored with a leading batch axis:
+      - teeth:       (batch, num_layers, rows, cols)
+      - driver:      (batch, rows, cols)
+      - will_rotate: (batch, rows, cols)
+
+    This is meant for truth-table sweeps: all 2^k input patterns of a k-input gate run in a
+    single pass (see input_patterns).
+    """
+    def __init__(self, batch_size, rows, cols, num_layers, num_teeth=8):
+        super().__init__(rows, cols, num_layers, num_teeth)
+        self.batch_size = batch_size
+        self.teeth = np.zeros((batch_size,) + self.teeth.shape, dtype=self.teeth.dtype)
+        self.driver = np.zeros((batch_size, rows, cols), dtype=bool)
+        self.will_rotate = np.zeros((batch_size, rows, cols), dtype=bool)
+
+    @classmethod
+    def from_grid(cls, grid):
+        """
+        Build a batch of one variant holding the same state as `grid`.
+        """
+        return cls.from_grids([grid])
+
+    @classmethod
+    def from_grids(cls, grids):
+        """
+        Stack several MultiLayerGearGrid (or NumpyGearGrid) variants into one batch.
+        """
+        variants = [
+            grid if isinstance(grid, NumpyGearGrid) else NumpyGearGrid.from_grid(grid)
+            for grid in grids
+        ]
+        if not variants:
+            raise ValueError("At least one grid is needed to build a batch")
+
+        first = variants[0]
+        for variant in variants[1:]:
+            if ((variant.rows, variant.cols, variant.num_layers, variant.num_teeth) !=
+                    (first.rows, first.cols, first.num_layers, first.num_teeth)):
+                raise ValueError("All grids in a batch must have the same dimensions")
+            if not np.array_equal(variant.direction, first.direction):
+                raise ValueError("All grids in a batch must have the same gear directions")
+
+        batch = cls(len(variants), first.rows, first.cols, first.num_layers, first.num_teeth)
+        batch.direction = first.direction.copy()
+        batch.teeth = np.stack([variant.teeth for variant in variants])
+        batch.driver = np.stack([variant.driver for variant in variants])
+        batch.will_rotate = np.stack([variant.will_rotate for variant in variants])
+        return batch
+
+    @classmethod
+    def input_patterns(cls, grid, input_positions):
+        """
+        Build the 2^k variants of `grid` for the k gears in `input_positions`: in variant b,
+        the gear at input_positions[k] is a 'Driver' if bit k of b is set and 'Driven'
+        otherwise. All other gears keep their type from `grid`.
+
+        :param grid:            A MultiLayerGearGrid or NumpyGearGrid.
+        :param input_positions: List of (row, col) positions of the input drivers.
+        """
+        base = grid if isinstance(grid, NumpyGearGrid) else NumpyGearGrid.from_grid(grid)
+        batch = cls.from_grids([base] * (1 << len(input_positions)))
+        for k, (i, j) in enumerate(input_positions):
+            batch.driver[:, i, j] = (np.arange(batch.batch_size) >> k) & 1 == 1
+        return batch
+
+    def instance(self, index):
+        """
+        Return variant `index` as a standalone NumpyGearGrid.
+        """
+        variant = NumpyGearGrid(self.rows, self.cols, self.num_layers, self.num_teeth)
+        variant.teeth = self.teeth[index].copy()
+        variant.driver = self.driver[index].copy()
+        variant.direction = self.direction.copy()
+        variant.will_rotate = self.will_rotate[index].copy()
+        return variant
+
+    def to_grid(self, index=0):
+        return self.instance(index).to_grid()
+
+    def to_grids(self):
+        return [self.to_grid(index) for index in range(self.batch_size)]
+
+    def save_grid_state(self, filename, index=0):
+        self.to_grid(index).save_grid_state(filename)
+
+    @classmethod
+    def load_grid_state(cls, filename):
+        return cls.from_grids([MultiLayerGearGrid.load_grid_state(filename)])
@@ -0,0 +1,191 @@
+"""
+Opt-in profiling of the simulation and rendering loop.
+
+Grids (MultiLayerGearGrid, NumpyGearGrid) and GearGridVisualizer have a `profiler`
+attribute that is None by default, which costs one attribute check per profiled call.
+Attach a Profiler to collect, for every tick, the wall time of each phase and counters:
+
+    profiler = Profiler()
+    profiler.attach(grid, visualizer)
+    ...run...
+    print(profiler.summary())
+    profiler.dump("profile.csv")  # or .json
+
+Phases: prepare_iteration, iterate, rotate_gears, draw_grid (which includes save_png when
+the visualizer saves frames), save_png, plus any phase timed by the caller with
+`with profiler.phase(name):`.
+Counters: propagation_sweeps, edges_examined, gears_activated, gears_rotated,
+polygons_drawn, plus any counted by the caller with profiler.count(name, value).
+
+A tick record runs from one rotate_gears() call to the next, so it holds the rotation of
+tick t and everything done before it (all animation sub-steps of that tick).
+"""
+import csv
+import functools
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+def profiled(phase, ends_tick=False):
+    """
+    Decorator for methods of objects with a `profiler` attribute: time the call as `phase`
+    when a profiler is attached. With `ends_tick`, the profiler's current tick record is
+    closed after the call (used by rotate_gears).
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if profiler is None:
+                return method(self, *args, **kwargs)
+            start = profiler.clock()
+            result = method(self, *args, **kwargs)
+            profiler.add_time(phase, start)
+            if ends_tick:
+                profiler.end_tick(getattr(self, "tick", None))
+            return result
+        return wrapper
+    return decorator
+
+
+class Profiler:
+    """
+    Collects per-tick phase times (in seconds) and counters. Only the last `max_ticks`
+    tick records are kept.
+    """
+    clock = staticmethod(time.perf_counter)
+
+    def __init__(self, max_ticks=10000):
+        self.records = deque(maxlen=max_ticks)
+        self.current = self._new_record(0)
+
+    @staticmethod
+    def _new_record(tick):
+        return {"tick": tick, "times": {}, "counters": {}}
+
+    def attach(self, *targets):
+        """
+        Start profiling grids and visualizers. The current record is numbered with the
+        first target's tick, if it has one.
+        """
+        for target in targets:
+            target.profiler = self
+        tick = getattr(targets[0], "tick", None) if targets else None
+        if tick is not None and not self.current["times"] and not self.current["counters"]:
+            self.current["tick"] = tick
+
+    @staticmethod
+    def detach(*targets):
+        for target in targets:
+            target.profiler = None
+
+    def add_time(self, phase, start):
+        """
+        Add the time elapsed since `start` (a value of clock()) to `phase`.
+        """
+        elapsed = self.clock() - start
+        times = self.current["times"]
+        times[phase] = times.get(phase, 0.0) + elapsed
+
+    def count(self, name, value=1):
+        counters = self.current["counters"]
+        counters[name] = counters.get(name, 0) + value
+
+    @contextmanager
+    def phase(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add_time(name, start)
+
+    def end_tick(self, next_tick=None):
+        """
+        Close the current tick record and start the next one, numbered `next_tick` (or the
+        current number plus one).
+        """
+        self.records.append(self.current)
+        if next_tick is None:
+            next_tick = self.current["tick"] + 1
+        self.current = self._new_record(next_tick)
+
+    def reset(self):
+        self.records.clear()
+        self.current = self._new_record(self.current["tick"])
+
+    @property
+    def last(self):
+        """
+        The most recent closed tick record, or the open one if no tick has ended yet.
+        """
+        return self.records[-1] if self.records else self.current
+
+    def phase_names(self):
+        names = {}
+        for record in self.records:
+            names.update(dict.fromkeys(record["times"]))
+        return list(names)
+
+    def counter_names(self):
+        names = {}
+        for record in self.records:
+            names.update(dict.fromkeys(record["counters"]))
+        return list(names)
+
+    def summary(self):
+        """
+        Return totals, means and maxima of every phase and counter over the kept records.
+        """
+        ticks = len(self.records)
+        summary = {"ticks": ticks, "phases": {}, "counters": {}}
+        for section, key in (("phases", "times"), ("counters", "counters")):
+            names = self.phase_names() if key == "times" else self.counter_names()
+            for name in names:
+                values = [record[key].get(name, 0) for record in self.records]
+                total = sum(values)
+                summary[section][name] = {
+                    "total": total,
+                    "mean": total / ticks,
+                    "max": max(values),
+                }
+        return summary
+
+    def rows(self):
+        """
+        Return the tick records as a header row followed by one row per tick.
+        """
+        phases = self.phase_names()
+        counters = self.counter_names()
+        header = ["tick"] + [f"{phase}_seconds" for phase in phases] + counters
+        rows = [header]
+        for record in self.records:
+            rows.append([record["tick"]] +
+                        [record["times"].get(phase, 0.0) for phase in phases] +
+                        [record["counters"].get(counter, 0) for counter in counters])
+        return rows
+
+    def dump(self, filename):
+        """
+        Write the tick records to `filename`: CSV if it ends with ".csv", JSON otherwise
+        (records plus summary).
+        """
+        if filename.endswith(".csv"):
+            with open(filename, "w", newline="") as f:
+                csv.writer(f).writerows(self.rows())
+        else:
+            with open(filename, "w") as f:
+                json.dump({"summary": self.summary(), "ticks": list(self.records)}, f, indent=2)
+
+    def overlay_lines(self):
+        """
+        Return short text lines describing the last tick, for drawing over the canvas.
+        """
+        record = self.last
+        lines = [f"tick {record['tick']}"]
+        for phase, seconds in record["times"].items():
+            lines.append(f"{phase}: {seconds * 1000:.2f} ms")
+        for counter, value in record["counters"].items():
+            lines.append(f"{counter}: {value}")
+        return lines
@@ -0,0 +1,107 @@
+"""
+Headless runner: load a grid file, run it for N ticks without rendering and report the
+speed.
+
+    python -m gear_run wire.json --ticks 10000
+    python -m gear_run big.mmg --ticks 1000 --backend numpy --save final.mmg
+    python -m gear_run OR_gate.json --ticks 500 --trace or_gate.mmgt
+
+Only the simulation modules are imported (cv2, PIL and tkinter are not), so batch jobs
+start quickly and run on machines without a display.
+"""
+import argparse
+import sys
+import time
+
+from gear_logic import MultiLayerGearGrid, SparseGearGrid
+
+BACKENDS = ("python", "sparse", "numpy")
+
+
+def load_grid(filename, backend="python", propagation="worklist"):
+    """
+    Load `filename` (.json or .mmg) into the grid class for `backend`.
+    """
+    if backend == "numpy":
+        # Imported here so that the pure Python backends do not need numpy.
+        from gear_numpy import NumpyGearGrid
+        return NumpyGearGrid.load_grid_state(filename)
+
+    grid_class = SparseGearGrid if backend == "sparse" else MultiLayerGearGrid
+    grid = grid_class.load_grid_state(filename)
+    grid.propagation = propagation
+    return grid
+
+
+def run(grid, ticks, skip_cycles=False):
+    """
+    Run `ticks` ticks of prepare_iteration / iterate / rotate_gears and return the elapsed
+    time in seconds. With `skip_cycles`, MultiLayerGearGrid.advance is used, which jumps
+    over whole periods once the circuit repeats.
+    """
+    start = time.perf_counter()
+    if skip_cycles:
+        grid.advance(ticks)
+    else:
+        for _ in range(ticks):
+            grid.prepare_iteration()
+            grid.iterate()
+            grid.rotate_gears()
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a gear grid without rendering.")
+    parser.add_argument("grid", help="grid file to load (.json or .mmg)")
+    parser.add_argument("-n", "--ticks", type=int, default=1000,
+                        help="number of ticks to run (default: 1000)")
+    parser.add_argument("--backend", choices=BACKENDS, default="python",
+                        help="grid implementation (default: python)")
+    parser.add_argument("--propagation", choices=MultiLayerGearGrid.PROPAGATION_MODES,
+                        default="worklist",
+                        help="propagation engine of the python/sparse backends (default: worklist)")
+    parser.add_argument("--skip-cycles", action="store_true",
+                        help="fast-forward once the circuit repeats (python/sparse backends)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="record which gears rotate on every tick (see gear_trace)")
+    parser.add_argument("--keyframe-interval", type=int, default=256,
+                        help="ticks between full keyframes in the trace (default: 256)")
+    parser.add_argument("--save", metavar="FILE",
+                        help="save the final grid state (.json or .mmg)")
+    args = parser.parse_args(argv)
+
+    if args.backend == "numpy" and (args.trace or args.skip_cycles):
+        parser.error("--trace and --skip-cycles need the python or sparse backend")
+
+    start = time.perf_counter()
+    grid = load_grid(args.grid, args.backend, args.propagation)
+    load_time = time.perf_counter() - start
+    print(f"Loaded {args.grid}: {grid.rows}x{grid.cols} gears, {grid.num_layers} layers, "
+          f"{grid.num_teeth} teeth ({load_time:.3f} s)")
+
+    recorder = None
+    if args.trace:
+        from gear_trace import TraceRecorder
+        recorder = TraceRecorder(grid, args.trace, keyframe_interval=args.keyframe_interval)
+    try:
+        elapsed = run(grid, args.ticks, skip_cycles=args.skip_cycles)
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+    rate = args.ticks / elapsed if elapsed > 0 else float("inf")
+    print(f"Ran {args.ticks} ticks in {elapsed:.3f} s ({rate:.1f} ticks/sec)")
+    if getattr(grid, "cycle", None) is not None:
+        cycle_tick, period = grid.cycle
+        print(f"Cycle of period {period} found at tick {cycle_tick}")
+    if args.trace:
+        print(f"Trace written to {args.trace}")
+
+    if args.save:
+        grid.save_grid_state(args.save)
+        print(f"Final state saved to {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""
+Append-only rotation trace (.mmgt) recording which gears turned on every tick.
+
+TraceRecorder listens to a grid's rotate_gears() calls (see
+MultiLayerGearGrid.rotation_listeners) and appends one record per tick; TraceReader replays
+the file or answers queries about single gears without re-simulating.
+
+The file is a 32-byte little-endian header (magic, version, header size, rows, cols,
+num_teeth, keyframe interval) followed by records. The rotation bitmap of tick t has bit
+i * cols + j set if gear (i, j) turned going from tick t to t + 1. Each record starts with a
+type byte:
+
+  b"K"  keyframe  varint tick, varint steps, the phase of every gear at `tick` (one byte
+                  per gear, two above 256 teeth, row by row), then the rotation bitmap as
+                  ceil(rows * cols / 8) bytes.
+  b"D"  delta     varint steps, varint payload size, then one varint per bit that differs
+                  from the previous record's bitmap, holding the number of unchanged bits
+                  since the last differing one. It describes the tick after the previous
+                  record.
+
+Delta records are mostly tiny, since a circuit usually rotates the same gears on
+consecutive ticks. A keyframe is written every `keyframe_interval` ticks, and whenever the
+recorded ticks skip forward (after advance() skipped a cycle or a seek), so that any tick
+can be decoded from the nearest keyframe. Ticks always increase through the file: ticks
+already recorded are not written again when the grid is re-simulated after seeking back.
+"""
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+from gear_history import iter_bits, rotation_bitmap
+
+TRACE_MAGIC = b"MMGT"
+TRACE_VERSION = 1
+HEADER_SIZE = 32
+
+# magic, version, header size, rows, cols, num_teeth, keyframe interval
+_HEADER = struct.Struct("<4sHHIIII")
+
+_KEYFRAME = ord("K")
+_DELTA = ord("D")
+
+
+def _phase_typecode(num_teeth):
+    return 'B' if num_teeth <= 256 else 'H'
+
+
+def _append_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class TraceRecorder:
+    """
+    Record every rotate_gears() call of `grid` into the trace file `filename` until close()
+    is called. Can be used as a context manager.
+    """
+    def __init__(self, grid, filename, keyframe_interval=256):
+        self.grid = grid
+        self.filename = filename
+        self.keyframe_interval = keyframe_interval
+        self._bitmap_bytes = (grid.rows * grid.cols + 7) // 8
+
+        self._file = open(filename, "wb")
+        header = _HEADER.pack(TRACE_MAGIC, TRACE_VERSION, HEADER_SIZE, grid.rows, grid.cols,
+                              grid.num_teeth, keyframe_interval)
+        self._file.write(header.ljust(HEADER_SIZE, b"\0"))
+
+        self._previous = set()      # Gear indices that turned on the last recorded tick.
+        self._next_tick = None      # Tick that a delta record would describe.
+        self._keyframe_tick = None  # Tick of the last keyframe.
+        grid.rotation_listeners.append(self._on_rotate)
+
+    def _on_rotate(self, grid, rotated, steps):
+        tick = grid.tick - 1
+        if self._next_tick is not None and tick < self._next_tick:
+            return  # Re-simulating after a seek back: this tick is already in the file.
+        # Work on the rotated gear indices, so that the cost of a delta record follows the
+        # number of moving gears instead of the grid size.
+        cols = grid.cols
+        indices = {i * cols + j for i, j in rotated}
+        record = bytearray()
+
+        if tick != self._next_tick or tick - self._keyframe_tick >= self.keyframe_interval:
+            # The grid has already turned, so undo this tick's rotation to get its phases.
+            phases = grid.get_phases()
+            for index in indices:
+                phases[index] = (phases[index] - steps) % grid.num_teeth
+            if sys.byteorder == "big":
+                phases.byteswap()
+
+            record.append(_KEYFRAME)
+            _append_varint(record, tick)
+            _append_varint(record, steps)
+            record += phases.tobytes()
+            record += rotation_bitmap(grid, rotated).to_bytes(self._bitmap_bytes, "little")
+            self._keyframe_tick = tick
+        else:
+            payload = bytearray()
+            last = -1
+            for index in sorted(indices ^ self._previous):
+                _append_varint(payload, index - last - 1)
+                last = index
+
+            record.append(_DELTA)
+            _append_varint(record, steps)
+            _append_varint(record, len(payload))
+            record += payload
+
+        self._file.write(record)
+        self._previous = indices
+        self._next_tick = tick + 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        """
+        Stop recording and close the file.
+        """
+        if self._on_rotate in self.grid.rotation_listeners:
+            self.grid.rotation_listeners.remove(self._on_rotate)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TraceReader:
+    """
+    Read a trace written by TraceRecorder. A record cut short at the end of the file (the
+    recording process was killed mid-write) is ignored; a keyframe whose tick is not after
+    the previous record's makes the file invalid.
+    """
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self._data = f.read()
+        data = self._data
+        if len(data) < HEADER_SIZE:
+            raise ValueError(f"{filename} is too short to be a trace file")
+
+        (magic, version, header_size, self.rows, self.cols, self.num_teeth,
+         self.keyframe_interval) = _HEADER.unpack_from(data)
+        if magic != TRACE_MAGIC:
+            raise ValueError(f"{filename} is not a trace file")
+        if version != TRACE_VERSION or header_size != HEADER_SIZE:
+            raise ValueError(f"Unsupported trace version {version} in {filename}")
+
+        num_gears = self.rows * self.cols
+        self._bitmap_bytes = (num_gears + 7) // 8
+        self._phase_bytes = num_gears * array(_phase_typecode(self.num_teeth)).itemsize
+
+        # One entry per record: its tick and the offset of its type byte.
+        self._ticks = []
+        self._offsets = []
+        self._keyframes = []  # Indices into _ticks of the keyframe records.
+        pos = HEADER_SIZE
+        tick = None
+        try:
+            while pos < len(data):
+                start = pos
+                kind = data[pos]
+                if kind == _KEYFRAME:
+                    keyframe_tick, pos = _read_varint(data, pos + 1)
+                    if tick is not None and keyframe_tick <= tick:
+                        raise ValueError(f"Ticks go backwards at offset {start} in {filename}")
+                    tick = keyframe_tick
+                    _, pos = _read_varint(data, pos)
+                    pos += self._phase_bytes + self._bitmap_bytes
+                    self._keyframes.append(len(self._ticks))
+                elif kind == _DELTA and tick is not None:
+                    tick += 1
+                    _, pos = _read_varint(data, pos + 1)
+                    size, pos = _read_varint(data, pos)
+                    pos += size
+                else:
+                    raise ValueError(f"Corrupt record at offset {start} in {filename}")
+                if pos > len(data):
+                    break
+                self._ticks.append(tick)
+                self._offsets.append(start)
+        except IndexError:
+            pass  # Truncated varint in the last record.
+
+    def __len__(self):
+        return len(self._ticks)
+
+    @property
+    def first_tick(self):
+        return self._ticks[0] if self._ticks else None
+
+    @property
+    def last_tick(self):
+        return self._ticks[-1] if self._ticks else None
+
+    def _decode(self, record, previous):
+        """
+        Return (tick, steps, bitmap, phases) for record number `record`; phases is None for
+        delta records, which need the bitmap of the record before.
+        """
+        data = self._data
+        pos = self._offsets[record]
+        if data[pos] == _KEYFRAME:
+            _, pos = _read_varint(data, pos + 1)
+            steps, pos = _read_varint(data, pos)
+            phases = array(_phase_typecode(self.num_teeth))
+            phases.frombytes(data[pos:pos + self._phase_bytes])
+            if sys.byteorder == "big":
+                phases.byteswap()
+            pos += self._phase_bytes
+            bitmap = int.from_bytes(data[pos:pos + self._bitmap_bytes], "little")
+            return self._ticks[record], steps, bitmap, phases
+
+        steps, pos = _read_varint(data, pos + 1)
+        size, pos = _read_varint(data, pos)
+        end = pos + size
+        flips = bytearray(self._bitmap_bytes)
+        index = -1
+        while pos < end:
+            gap, pos = _read_varint(data, pos)
+            index += gap + 1
+            flips[index >> 3] |= 1 << (index & 7)
+        return self._ticks[record], steps, previous ^ int.from_bytes(flips, "little"), None
+
+    def _keyframe_before(self, tick):
+        """
+        Return the index of the last keyframe record whose tick is at most `tick`.
+        """
+        record = bisect_right(self._ticks, tick) - 1
+        if record < 0:
+            raise ValueError(f"Tick {tick} is before the start of the trace ({self.first_tick})")
+        keyframe = bisect_right(self._keyframes, record) - 1
+        return self._keyframes[keyframe]
+
+    def _iter_records(self, start, stop):
+        # Yield (tick, steps, bitmap, phases) for the records with start <= tick < stop,
+        # decoding from the keyframe before `start`.
+        first = self._keyframe_before(start) if start > self.first_tick else 0
+        bitmap = 0
+        for record in range(first, len(self._ticks)):
+            tick, steps, bitmap, phases = self._decode(record, bitmap)
+            if tick >= stop:
+                return
+            if tick >= start:
+                yield tick, steps, bitmap, phases
+
+    def iter_rotations(self, start=None, stop=None):
+        """
+        Replay the trace: yield (tick, steps, bitmap) for every recorded tick in
+        [start, stop). See gear_history.iter_bits to list the gears in a bitmap.
+        """
+        if not self._ticks:
+            return
+        start = self.first_tick if start is None else start
+        stop = self.last_tick + 1 if stop is None else stop
+        for tick, steps, bitmap, _ in self._iter_records(start, stop):
+            yield tick, steps, bitmap
+
+    def rotated(self, tick):
+        """
+        Return the (i, j) positions of the gears that turned on `tick`.
+        """
+        for _, _, bitmap in self.iter_rotations(tick, tick + 1):
+            return [divmod(index, self.cols) for index in iter_bits(bitmap)]
+        raise ValueError(f"Tick {tick} is not in the trace")
+
+    def gear_history(self, i, j, start=None, stop=None):
+        """
+        Return the ticks in [start, stop) on which gear (i, j) turned.
+        """
+        bit = 1 << (i * self.cols + j)
+        return [tick for tick, _, bitmap in self.iter_rotations(start, stop) if bitmap & bit]
+
+    def phases_at(self, tick):
+        """
+        Return the phases of every gear at `tick` (before that tick's rotation), like
+        MultiLayerGearGrid.get_phases. `tick` may be one past the last recorded tick.
+        """
+        if not self._ticks or not self.first_tick <= tick <= self.last_tick + 1:
+            raise ValueError(f"Tick {tick} is outside the trace")
+
+        keyframe = self._keyframe_before(min(tick, self.last_tick))
+        phases = None
+        bitmap = 0
+        for record in range(keyframe, len(self._ticks)):
+            if self._ticks[record] >= tick:
+                break
+            record_tick, steps, bitmap, keyframe_phases = self._decode(record, bitmap)
+            if keyframe_phases is not None:
+                phases = keyframe_phases
+            for index in iter_bits(bitmap):
+                phases[index] = (phases[index] + steps) % self.num_teeth
+        if phases is None:
+            phases = self._decode(keyframe, 0)[3]
+        elif record_tick + 1 != tick:
+            raise ValueError(f"Tick {tick} was not recorded")
+        return phases
+
+    def restore(self, grid, tick):
+        """
+        Turn the gears of `grid` (the grid the trace was recorded from, or a copy of it)
+        to their phases at `tick`.
+        """
+        grid.set_phases(self.phases_at(tick), tick=tick)
@@ -3,6 +3,10 @@ import cv2
 import numpy as np
 import os
 import random
+from collections import OrderedDict
+
+from gear_frames import FrameWriter
+from gear_profile import profiled
 
 random.seed(4468)
 
@@ -12,8 +16,18 @@ layer_colors = [
     for _ in range(100)
 ]
 
+# Colours of the zoomed-out levels of detail, indexed by state code: empty, populated,
+# rotating, driver.
+STATE_EMPTY, STATE_POPULATED, STATE_ROTATING, STATE_DRIVER = range(4)
+state_colors = np.array([(0, 0, 0), (110, 110, 110), (255, 255, 255), (0, 255, 255)],
+                        dtype=np.uint8)
+
 class GearGridVisualizer:
-    def __init__(self, gear_grid, base_radius, screen_width=800, screen_height=600, save=True):
+    profiler = None  # Set by gear_profile.Profiler.attach.
+
+    def __init__(self, gear_grid, base_radius, screen_width=800, screen_height=600, save=True,
+                 sprite_cache_size=0, block_lod_pixels=6, disc_lod_pixels=16,
+                 frame_writer=None):
         self.gear_grid = gear_grid
         self.base_radius = base_radius
 
@@ -32,6 +46,33 @@ class GearGridVisualizer:
 
         self.save = save
         self.canvas_idx = 0
+        # Saved frames are encoded in the background by this FrameWriter; one is created on
+        # the first save if none is given, and closed by close().
+        self.frame_writer = frame_writer
+        self._owns_writer = frame_writer is None
+        self.polygons_drawn = 0  # Shapes rasterised by the last draw_grid().
+
+        # With sprite_cache_size > 0, gears are drawn once per distinct look (teeth, angle,
+        # zoom, driver) and then copied into the canvas; up to sprite_cache_size looks are
+        # kept, least recently used first out. 0 draws the visible gears with a few batched
+        # OpenCV calls per layer instead.
+        self.sprite_cache_size = sprite_cache_size
+        self._sprites = OrderedDict()
+        self._trig_tables = {}  # (num_teeth, angle offset) -> cos/sin tables.
+
+        # Levels of detail, by the on-screen distance between two gear centres: below
+        # block_lod_pixels every gear is a block coloured by its state (see state_colors),
+        # below disc_lod_pixels a disc of that colour, and the full geometry otherwise.
+        self.block_lod_pixels = block_lod_pixels
+        self.disc_lod_pixels = disc_lod_pixels
+
+        # Canvas holding only the gears that do not rotate this tick, the state it was drawn
+        # for, and the visible rotating gears with their screen boxes (see draw_grid).
+        self._background = None
+        self._background_key = None
+        self._moving = []
+        self._moving_boxes = []
+        self._codes = None  # (grid key, region, state codes) of the last block drawing.
 
         if self.save and not os.path.exists("images"):
             os.makedirs("images")
@@ -52,6 +93,7 @@ class GearGridVisualizer:
             center_screen[1] + radius_screen < 0 or
             center_screen[1] - radius_screen > self.screen_height):
             return
+        self.polygons_drawn += 1
         cv2.circle(self.canvas, center=center_screen, radius=radius_screen,
                    color=color, thickness=thickness, **kwargs)
 
@@ -62,6 +104,7 @@ class GearGridVisualizer:
         if (np.all(xs < 0) or np.all(xs > self.screen_width) or
             np.all(ys < 0) or np.all(ys > self.screen_height)):
             return
+        self.polygons_drawn += 1
         cv2.fillPoly(self.canvas, [pts_screen], color, **kwargs)
 
     def projected_polylines(self, pts, isClosed, color, thickness, **kwargs):
@@ -71,26 +114,51 @@ class GearGridVisualizer:
         if (np.all(xs < 0) or np.all(xs > self.screen_width) or
             np.all(ys < 0) or np.all(ys > self.screen_height)):
             return
+        self.polygons_drawn += 1
         cv2.polylines(self.canvas, [pts_screen], isClosed=isClosed,
                       color=color, thickness=thickness, **kwargs)
 
-    def _draw_one_gear(self, gear, i, j, delta_angle):
-        center_x = j * 2 * self.base_radius + self.base_radius * 1.2
-        center_y = i * 2 * self.base_radius + self.base_radius * 1.2
-
+    def visible_range(self):
+        """
+        Return (row_start, row_stop, col_start, col_stop), the rectangle of grid positions
+        whose gears can reach into the screen, computed from the window and zoom.
+        """
+        # World-space reach of a gear from its centre, as used for the sprite boxes.
+        extent = self._sprite_half_size() / self.zoom
+        spacing = 2 * self.base_radius
+        offset = self.base_radius * 1.2
+        col_start = math.ceil((self.window_x - extent - offset) / spacing)
+        col_stop = math.floor((self.window_x + self.screen_width / self.zoom + extent - offset)
+                              / spacing) + 1
+        row_start = math.ceil((self.window_y - extent - offset) / spacing)
+        row_stop = math.floor((self.window_y + self.screen_height / self.zoom + extent - offset)
+                              / spacing) + 1
+        return (max(row_start, 0), min(row_stop, self.gear_grid.rows),
+                max(col_start, 0), min(col_stop, self.gear_grid.cols))
+
+    def _gear_center(self, i, j):
+        return (j * 2 * self.base_radius + self.base_radius * 1.2,
+                i * 2 * self.base_radius + self.base_radius * 1.2)
+
+    def _gear_shapes(self, gear, center_x, center_y, angle_offset):
+        """
+        Yield the shapes of one gear in drawing order, in world coordinates, as
+        (kind, points, color, radius) with kind "circle" (points holds the centre),
+        "poly" (filled) or "polyline" (closed outline).
+        """
         gear_radius = 0.75 * self.base_radius
         tooth_length = gear_radius * 0.4
 
         step = 360 / gear.num_teeth
         half_tooth_deg = 180 / gear.num_teeth
-        angle_offset = delta_angle * gear.direction
 
         if gear.gear_type == "Driver":
-            self.projected_circle((center_x, center_y),
-                                  0.8 * gear_radius + tooth_length,
-                                  color=(0, 255, 255), thickness=-1)
+            yield ("circle", [(center_x, center_y)], (0, 255, 255),
+                   0.8 * gear_radius + tooth_length)
 
         gear_points_world = []
+        # Read the flags once, with the gear's phase applied.
+        layers_teeth_flags = gear.current_teeth_flags()
 
         for layer_idx in range(gear.num_layers):
             layer_factor = gear_radius / 30.0
@@ -99,7 +167,7 @@ class GearGridVisualizer:
 
             color = layer_colors[layer_idx % len(layer_colors)]
             
-            if not (True in gear.layers_teeth_flags[layer_idx]):
+            if not (True in layers_teeth_flags[layer_idx]):
                 continue 
                 
             for tooth_idx in range(gear.num_teeth):
@@ -118,41 +186,402 @@ class GearGridVisualizer:
                 )
 
                 sector_pts = [p1_world, p2_world, (center_x, center_y)]
-                self.projected_fillPoly(sector_pts, color)
+                yield ("poly", sector_pts, color, None)
                 gear_points_world.append(p1_world)
 
-                if gear.layers_teeth_flags[layer_idx][tooth_idx]:
+                if layers_teeth_flags[layer_idx][tooth_idx]:
                     mid_angle = 0.5 * (start_rad + end_rad)
                     tip_world = (
                         center_x + (current_tip_radius + tooth_length) * math.cos(mid_angle),
                         center_y + (current_tip_radius + tooth_length) * math.sin(mid_angle)
                     )
                     tooth_pts = [p1_world, p2_world, tip_world]
-                    self.projected_fillPoly(tooth_pts, color)
+                    yield ("poly", tooth_pts, color, None)
                     gear_points_world.append(tip_world)
 
             if layer_idx == 0 and gear_points_world:
-                self.projected_polylines(gear_points_world, isClosed=True,
-                                         color=(255, 0, 0), thickness=1)
+                yield ("polyline", gear_points_world, (255, 0, 0), None)
+
+    # Batched drawing
+
+    def _trig_table(self, num_teeth, angle_offset):
+        """
+        Return (cos, sin) of the sector edge angles (num_teeth + 1 values) and (cos, sin) of
+        the tooth tip angles (num_teeth values) of a gear turned by `angle_offset` degrees.
+        Only a few offsets occur (one per animation sub-step and direction), so each table
+        is computed once.
+        """
+        key = (num_teeth, angle_offset)
+        table = self._trig_tables.get(key)
+        if table is None:
+            step = 360 / num_teeth
+            half_tooth_deg = 180 / num_teeth
+            edges = [math.radians(angle_offset + tooth_idx * step - half_tooth_deg)
+                     for tooth_idx in range(num_teeth + 1)]
+            tips = [0.5 * (edges[k] + edges[k + 1]) for k in range(num_teeth)]
+            table = (np.array([math.cos(a) for a in edges]), np.array([math.sin(a) for a in edges]),
+                     np.array([math.cos(a) for a in tips]), np.array([math.sin(a) for a in tips]))
+            if len(self._trig_tables) >= 256:
+                self._trig_tables.clear()
+            self._trig_tables[key] = table
+        return table
+
+    def _visible_gear_groups(self, gears, delta_angle):
+        """
+        Collect the (i, j, gear) triples that reach into the screen, grouped by
+        (num_teeth, num_layers, angle offset), as dicts of NumPy arrays.
+        """
+        extent = 1.05 * self.base_radius
+        x_min = self.window_x - extent
+        x_max = self.window_x + self.screen_width / self.zoom + extent
+        y_min = self.window_y - extent
+        y_max = self.window_y + self.screen_height / self.zoom + extent
+
+        groups = {}
+        for i, j, gear in gears:
+            center_x, center_y = self._gear_center(i, j)
+            if not (x_min <= center_x <= x_max and y_min <= center_y <= y_max):
+                continue
+            angle_offset = (delta_angle if gear.will_rotate else 0) * gear.direction
+            key = (gear.num_teeth, gear.num_layers, angle_offset)
+            members = groups.setdefault(key, ([], [], [], [], []))
+            members[0].append(center_x)
+            members[1].append(center_y)
+            members[2].append(gear.current_tooth_masks())
+            members[3].append(gear.gear_type == "Driver")
+            members[4].append((i + j) % 2)
+
+        return [(key, {"x": np.array(xs), "y": np.array(ys),
+                       "masks": np.array(masks, dtype=np.int64).reshape(len(xs), key[0]),
+                       "driver": np.array(drivers, dtype=bool),
+                       "parity": np.array(parities)})
+                for key, (xs, ys, masks, drivers, parities) in groups.items()]
+
+    def _to_screen(self, x, y):
+        """
+        Vectorised transform_point: map world coordinate arrays to int32 (..., 2) pixels.
+        """
+        return np.stack([((x - self.window_x) * self.zoom).astype(np.int32),
+                         ((y - self.window_y) * self.zoom).astype(np.int32)], axis=-1)
+
+    def _draw_gears_batched(self, gears, delta_angle):
+        """
+        Draw the visible gears among the (i, j, gear) triples `gears` with a handful of
+        OpenCV calls: all driver discs, then for each layer one fillPoly per colour and
+        checkerboard parity with every sector and tooth of that layer, with the layer 0
+        outlines after layer 0.
+
+        fillPoly fills overlapping polygons of one call with the even-odd rule, and the tips
+        of two meshing neighbours overlap, so neighbours are never put in the same call.
+        """
+        gear_radius = 0.75 * self.base_radius
+        tooth_length = gear_radius * 0.4
+        groups = self._visible_gear_groups(gears, delta_angle)
+
+        for _, members in groups:
+            drivers = members["driver"]
+            for center_x, center_y in zip(members["x"][drivers], members["y"][drivers]):
+                self.projected_circle((center_x, center_y), 0.8 * gear_radius + tooth_length,
+                                      color=(0, 255, 255), thickness=-1)
 
+        for _, members in groups:
+            members["center"] = self._to_screen(members["x"], members["y"])[:, None, :]
+        max_layers = max((key[1] for key, _ in groups), default=0)
+
+        for layer_idx in range(max_layers):
+            layer_factor = gear_radius / 30.0
+            current_radius = gear_radius + 4 * (-layer_factor * layer_idx)
+            current_tip_radius = gear_radius
+            color = layer_colors[layer_idx % len(layer_colors)]
+
+            polygons = ([], [])  # One list per checkerboard parity.
+            outlines = []
+            for (num_teeth, num_layers, angle_offset), members in groups:
+                if layer_idx >= num_layers:
+                    continue
+                flags = ((members["masks"] >> layer_idx) & 1).astype(bool)
+                present = flags.any(axis=1)
+                if not present.any():
+                    continue
+
+                cos_e, sin_e, cos_t, sin_t = self._trig_table(num_teeth, angle_offset)
+                x = members["x"][present, None]
+                y = members["y"][present, None]
+                flags = flags[present]
+                edges = self._to_screen(x + current_radius * cos_e, y + current_radius * sin_e)
+                tips = self._to_screen(x + (current_tip_radius + tooth_length) * cos_t,
+                                       y + (current_tip_radius + tooth_length) * sin_t)
+                centers = np.broadcast_to(members["center"][present], tips.shape)
+
+                sectors = np.stack([edges[:, :-1], edges[:, 1:], centers], axis=2)
+                teeth = np.stack([edges[:, :-1], edges[:, 1:], tips], axis=2)
+                parity = members["parity"][present]
+                for side in (0, 1):
+                    on_side = parity == side
+                    polygons[side].append(sectors[on_side].reshape(-1, 3, 2))
+                    polygons[side].append(teeth[flags & on_side[:, None]])
+
+                if layer_idx == 0:
+                    # Outline through each sector's first corner and, after it, its tooth tip.
+                    points = np.stack([edges[:, :-1], tips], axis=2).reshape(len(flags), -1, 2)
+                    keep = np.stack([np.ones_like(flags), flags], axis=2).reshape(len(flags), -1)
+                    counts = keep.sum(axis=1)
+                    outlines.extend(np.split(points[keep], np.cumsum(counts)[:-1]))
+
+            for side_polygons in polygons:
+                side_polygons = [p for p in side_polygons if len(p)]
+                if side_polygons:
+                    batch = np.ascontiguousarray(np.concatenate(side_polygons))
+                    self.polygons_drawn += len(batch)
+                    cv2.fillPoly(self.canvas, batch, color)
+            if outlines:
+                self.polygons_drawn += len(outlines)
+                cv2.polylines(self.canvas, outlines, isClosed=True, color=(255, 0, 0), thickness=1)
+
+    # Levels of detail
+
+    def detail_level(self):
+        """
+        Return "blocks", "discs" or "full", the level of detail for the current zoom.
+        """
+        spacing = 2 * self.base_radius * self.zoom
+        if spacing < self.block_lod_pixels:
+            return "blocks"
+        if spacing < self.disc_lod_pixels:
+            return "discs"
+        return "full"
+
+    @staticmethod
+    def state_codes(gears):
+        """
+        Return the state code (STATE_*) of each (i, j, gear) triple of `gears`.
+        """
+        return [STATE_DRIVER if gear.gear_type == "Driver" else
+                STATE_ROTATING if gear.will_rotate else
+                STATE_POPULATED if gear.has_teeth() else STATE_EMPTY
+                for _, _, gear in gears]
+
+    def _block_codes(self, region):
+        """
+        Return the (rows, cols) array of state codes of `region`, a (row_start, row_stop,
+        col_start, col_stop) tuple. The codes of the last region are kept until the grid
+        changes, so panning and zooming within it does not visit the gears again.
+        """
+        row_start, row_stop, col_start, col_stop = region
+        grid_key = (id(self.gear_grid), self.gear_grid.version, self.gear_grid.rotating)
+        if self._codes is not None:
+            codes_key, (r0, r1, c0, c1), codes = self._codes
+            if (codes_key == grid_key and r0 <= row_start and row_stop <= r1 and
+                    c0 <= col_start and col_stop <= c1):
+                return codes[row_start - r0:row_stop - r0, col_start - c0:col_stop - c0]
+
+        rows, cols = row_stop - row_start, col_stop - col_start
+        gears = list(self.gear_grid.iter_region(*region))
+        codes = np.zeros(rows * cols, dtype=np.uint8)
+        np.put(codes, [(i - row_start) * cols + (j - col_start) for i, j, _ in gears],
+               self.state_codes(gears))
+        codes = codes.reshape(rows, cols)
+        self._codes = (grid_key, region, codes)
+        return codes
+
+    def _draw_state_blocks(self, region):
+        """
+        Draw every gear of `region` as a block of its state colour: one pixel per gear,
+        scaled to the screen with a nearest-neighbour cv2.resize.
+        """
+        row_start, row_stop, col_start, col_stop = region
+        rows, cols = row_stop - row_start, col_stop - col_start
+        if rows <= 0 or cols <= 0:
+            return
+        codes = self._block_codes(region)
+
+        # Gear (i, j) covers the square of side 2 * base_radius around its centre.
+        cell = 2 * self.base_radius * self.zoom
+        x0, y0 = self.transform_point(col_start * 2 * self.base_radius + self.base_radius * 0.2,
+                                      row_start * 2 * self.base_radius + self.base_radius * 0.2)
+        width = max(int(round(cols * cell)), 1)
+        height = max(int(round(rows * cell)), 1)
+        image = cv2.resize(state_colors[codes], (width, height), interpolation=cv2.INTER_NEAREST)
+
+        cx0, cy0 = max(x0, 0), max(y0, 0)
+        cx1, cy1 = min(x0 + width, self.screen_width), min(y0 + height, self.screen_height)
+        if cx0 < cx1 and cy0 < cy1:
+            self.canvas[cy0:cy1, cx0:cx1] = image[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+        self.polygons_drawn += 1
+
+    def _draw_state_discs(self, visible):
+        """
+        Draw every populated gear as a disc of its state colour.
+        """
+        radius = max(int(0.9 * self.base_radius * self.zoom), 1)
+        for (i, j, _), code in zip(visible, self.state_codes(visible)):
+            if code != STATE_EMPTY:
+                self.polygons_drawn += 1
+                cv2.circle(self.canvas, self.transform_point(*self._gear_center(i, j)), radius,
+                           color=state_colors[code].tolist(), thickness=-1)
+
+    # Sprite cache
+
+    def _sprite_half_size(self):
+        # Tooth tips reach 1.05 base radii from the gear centre, driver discs 0.9.
+        return int(math.ceil(1.05 * self.base_radius * self.zoom)) + 2
+
+    def _gear_sprite(self, gear, angle_offset):
+        """
+        Return (image, mask) of a gear drawn at the current zoom, from the cache if a gear
+        with the same look was drawn before.
+        """
+        key = (gear.current_tooth_masks(), gear.num_layers, angle_offset, self.zoom,
+               gear.gear_type == "Driver")
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self._sprites.move_to_end(key)
+            return sprite
+
+        half = self._sprite_half_size()
+        image = np.zeros((2 * half + 1, 2 * half + 1, 3), dtype=np.uint8)
+        for kind, points, color, radius in self._gear_shapes(gear, 0.0, 0.0, angle_offset):
+            pts = np.array([(int(half + x * self.zoom), int(half + y * self.zoom))
+                            for (x, y) in points], dtype=np.int32)
+            self.polygons_drawn += 1
+            if kind == "poly":
+                cv2.fillPoly(image, [pts], color)
+            elif kind == "circle":
+                cv2.circle(image, center=(half, half), radius=int(radius * self.zoom),
+                           color=color, thickness=-1)
+            else:
+                cv2.polylines(image, [pts], isClosed=True, color=color, thickness=1)
+        # No gear colour is pure black, so every painted pixel belongs to the sprite.
+        mask = image.any(axis=2)[..., None]
+
+        sprite = (image, mask)
+        self._sprites[key] = sprite
+        if len(self._sprites) > self.sprite_cache_size:
+            self._sprites.popitem(last=False)
+        return sprite
+
+    def _blit_one_gear(self, gear, i, j, delta_angle):
+        """
+        Copy the gear's cached sprite into the canvas, clipped to the screen.
+        """
+        half = self._sprite_half_size()
+        screen_x, screen_y = self.transform_point(*self._gear_center(i, j))
+        x0, y0 = screen_x - half, screen_y - half
+        x1, y1 = screen_x + half + 1, screen_y + half + 1
+        if x1 <= 0 or y1 <= 0 or x0 >= self.screen_width or y0 >= self.screen_height:
+            return
+
+        image, mask = self._gear_sprite(gear, delta_angle * gear.direction)
+        cx0, cy0 = max(x0, 0), max(y0, 0)
+        cx1, cy1 = min(x1, self.screen_width), min(y1, self.screen_height)
+        np.copyto(self.canvas[cy0:cy1, cx0:cx1],
+                  image[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0],
+                  where=mask[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0])
+
+    # Static background
+
+    def invalidate_background(self):
+        """
+        Discard the cached background. Needed only after editing gears or rotation flags in
+        place without calling the grid's invalidate(); ticks, propagation and view changes
+        are detected through the grid's version, tick, rotating list and the window.
+        """
+        self._background_key = None
+
+    def _draw_gears(self, gears, delta_angle):
+        # Draw (i, j, gear) triples, turning those that will rotate by delta_angle.
+        if self.sprite_cache_size:
+            for i, j, gear in gears:
+                self._blit_one_gear(gear, i, j, delta_angle if gear.will_rotate else 0)
+        else:
+            self._draw_gears_batched(gears, delta_angle)
+
+    def _gear_box(self, i, j):
+        """
+        Return the (y0, y1, x0, x1) screen box covering gear (i, j), clipped to the screen,
+        or None if the gear is off-screen.
+        """
+        half = self._sprite_half_size()
+        screen_x, screen_y = self.transform_point(*self._gear_center(i, j))
+        x0, y0 = max(screen_x - half, 0), max(screen_y - half, 0)
+        x1 = min(screen_x + half + 1, self.screen_width)
+        y1 = min(screen_y + half + 1, self.screen_height)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return (y0, y1, x0, x1)
+
+    @profiled("draw_grid")
     def draw_grid(self, delta_angle):
-        self.canvas[:] = (0, 0, 0)
-        for i, row in enumerate(self.gear_grid.grid):
-            for j, gear in enumerate(row):
-                if gear.will_rotate:
-                    self._draw_one_gear(gear, i, j, delta_angle)
+        """
+        Draw the grid with the gears that will rotate turned by delta_angle.
+
+        Only the gears in visible_range() are visited, so the cost follows the screen, not
+        the grid size, and zoomed-out views are drawn at a lower detail_level(). At full
+        detail the gears that stay still are drawn once per tick into a background buffer.
+        The following sub-steps of the same tick only restore the boxes of the rotating
+        gears from it and redraw those gears.
+        """
+        self.polygons_drawn = 0
+        level = self.detail_level()
+        key = (id(self.gear_grid), self.gear_grid.version, self.gear_grid.tick, self.window_x,
+               self.window_y, self.zoom, self.sprite_cache_size, level, self.gear_grid.rotating)
+
+        if key != self._background_key:
+            self.canvas[:] = (0, 0, 0)
+            self._background_key = key
+            self._moving = []
+            self._moving_boxes = []
+            region = self.visible_range()
+            if level == "blocks":
+                self._draw_state_blocks(region)
+            else:
+                visible = list(self.gear_grid.iter_region(*region))
+                if level == "discs":
+                    self._draw_state_discs(visible)
                 else:
-                    self._draw_one_gear(gear, i, j, 0)
+                    self._moving = [(i, j, gear) for i, j, gear in visible if gear.will_rotate]
+                    self._draw_gears([(i, j, gear) for i, j, gear in visible
+                                      if not gear.will_rotate], 0)
+                    self._background = self.canvas.copy()
+                    self._moving_boxes = [box for box in (self._gear_box(i, j)
+                                                          for i, j, _ in self._moving)
+                                          if box is not None]
+        else:
+            background = self._background
+            for y0, y1, x0, x1 in self._moving_boxes:
+                self.canvas[y0:y1, x0:x1] = background[y0:y1, x0:x1]
+
+        # Blocks and discs do not turn, so only the full level has anything left to draw.
+        if level == "full":
+            self._draw_gears(self._moving, delta_angle)
+        if self.profiler is not None:
+            self.profiler.count("polygons_drawn", self.polygons_drawn)
 
         if self.save:
             self.save_canvas()
 
+    @profiled("save_png")
     def save_canvas(self):
-        img_rgb = cv2.cvtColor(self.canvas, cv2.COLOR_BGR2RGB)
-        filename = f"images/{self.canvas_idx:04d}.png"
-        cv2.imwrite(filename, img_rgb)
+        """
+        Queue the canvas to be written to images/NNNN.png by the frame writer.
+        """
+        if self.frame_writer is None:
+            self.frame_writer = FrameWriter()
+        self.frame_writer.submit(self.canvas, f"images/{self.canvas_idx:04d}.png")
         self.canvas_idx += 1
 
+    def close(self):
+        """
+        Wait for the queued frames to be written, and stop the frame writer if the
+        visualizer created it.
+        """
+        if self.frame_writer is not None:
+            if self._owns_writer:
+                self.frame_writer.close()
+                self.frame_writer = None
+            else:
+                self.frame_writer.flush()
+
     def move_window(self, dx, dy):
         self.window_x += dx
         self.window_y += dy
@@ -176,12 +176,14 @@ def main():
             time.sleep(0.01)
             key = cv2.waitKey(1)  # Adjust speed here (1 ms per frame)
             if key == 113:  # Press 'q' to quit.
+                visualizer.close()
                 cv2.destroyAllWindows()
                 return
 
         # Rotate the gears that are flagged.
         grid.rotate_gears()
         
+    visualizer.close()
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
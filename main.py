@@ -8,8 +8,11 @@ import cv2
 import numpy as np
 from PIL import Image, ImageTk
 
+from gear_frames import FrameWriter
 from gear_logic import MultiLayerGearGrid  # Ensure this module includes the custom copy() methods.
 from gear_visualization import GearGridVisualizer  # Your visualization module.
+from gear_history import TickHistory
+from gear_profile import Profiler
 
 def reseter(grid, x, y, di=0):
     grid.grid[y][x].layers_teeth_flags[0][4] = True
@@ -37,6 +40,10 @@ class GearApp(tk.Tk):
         self.grid_obj = None
         self.init_grid = None  # This will hold the initial grid state.
         self.visualizer = None
+        self.frame_writer = FrameWriter()  # Saves the frames of every visualizer in the background.
+        self.history = None  # Keyframes for seeking back to earlier ticks.
+        self.profiler = Profiler()
+        self.profiling = False
 
         # Animation control.
         self.playing = False
@@ -64,7 +71,10 @@ class GearApp(tk.Tk):
         # Set the initial grid using the custom copy method.
         self.init_grid = self.grid_obj.copy()
 
-        self.visualizer = GearGridVisualizer(self.grid_obj, base_radius=self.base_radius)
+        self.visualizer = GearGridVisualizer(self.grid_obj, base_radius=self.base_radius,
+                                             frame_writer=self.frame_writer)
+        self.start_history()
+        self.attach_profiler()
 
         # Show the initial image.
         self.update_canvas()
@@ -85,10 +95,30 @@ class GearApp(tk.Tk):
         self.btn_step = tk.Button(button_frame, text="Step", command=self.step_animation)
         self.btn_step.pack(side=tk.LEFT, padx=2)
 
+        # Step back button: undo one animation step (only works when paused).
+        self.btn_step_back = tk.Button(button_frame, text="Step Back", command=self.step_back)
+        self.btn_step_back.pack(side=tk.LEFT, padx=2)
+
         # Reset button: restore the grid to its initially loaded/default state.
         self.btn_reset = tk.Button(button_frame, text="Reset", command=self.reset_animation)
         self.btn_reset.pack(side=tk.LEFT, padx=2)
 
+        # Profile button: toggle timing of each phase, shown over the image.
+        self.btn_profile = tk.Button(button_frame, text="Profile", command=self.toggle_profile)
+        self.btn_profile.pack(side=tk.LEFT, padx=2)
+
+        # Save the recorded profile as CSV or JSON.
+        self.btn_save_profile = tk.Button(button_frame, text="Save Profile", command=self.save_profile)
+        self.btn_save_profile.pack(side=tk.LEFT, padx=2)
+
+        # Slider for seeking to any recorded tick. Only user drags seek, so that moving the
+        # slider along with the animation does not trigger a seek.
+        self.seek_scale = tk.Scale(self, from_=0, to=0, orient=tk.HORIZONTAL, label="Tick",
+                                   showvalue=True)
+        self.seek_scale.pack(side=tk.TOP, fill=tk.X, padx=5)
+        self.seek_scale.bind("<B1-Motion>", self.on_seek)
+        self.seek_scale.bind("<ButtonRelease-1>", self.on_seek)
+
         # Label for displaying the gear grid image.
         self.image_label = tk.Label(self)
         self.image_label.pack(padx=5, pady=5)
@@ -115,9 +145,9 @@ class GearApp(tk.Tk):
             f.write(filename)
 
     def load_file(self):
-        """Open a file dialog to load a gear grid JSON file."""
+        """Open a file dialog to load a gear grid JSON or .mmg file."""
         filename = filedialog.askopenfilename(
-            filetypes=[("JSON Files", "*.json"), ("All Files", "*.*")]
+            filetypes=[("JSON Files", "*.json"), ("Binary Grid Files", "*.mmg"), ("All Files", "*.*")]
         )
         if filename:
             self.load_grid_from_file(filename)
@@ -129,8 +159,11 @@ class GearApp(tk.Tk):
             self.grid_obj = MultiLayerGearGrid.load_grid_state(filename)
             # Set the initial grid using the custom copy method.
             self.init_grid = self.grid_obj.copy()
-            self.visualizer = GearGridVisualizer(self.grid_obj, base_radius=self.base_radius)
+            self.visualizer = GearGridVisualizer(self.grid_obj, base_radius=self.base_radius,
+                                             frame_writer=self.frame_writer)
             self.current_step = 0
+            self.start_history()
+            self.attach_profiler()
             self.update_canvas()
         except Exception as e:
             print("Error loading file:", e)
@@ -197,7 +230,8 @@ class GearApp(tk.Tk):
         self.grid_obj = self.init_grid.copy()
 
         # Reinitialize the visualizer with the new grid.
-        self.visualizer = GearGridVisualizer(self.grid_obj, base_radius=self.base_radius)
+        self.visualizer = GearGridVisualizer(self.grid_obj, base_radius=self.base_radius,
+                                             frame_writer=self.frame_writer)
         # Restore the window settings.
         self.visualizer.zoom = current_zoom
         self.visualizer.window_x = current_window_x
@@ -205,6 +239,8 @@ class GearApp(tk.Tk):
 
         self.current_step = 0
         self.btn_toggle.config(text="Play")
+        self.start_history()
+        self.attach_profiler()
         self.update_canvas()
 
 
@@ -215,6 +251,24 @@ class GearApp(tk.Tk):
         """
         if self.playing:
             return  # Do nothing if animation is playing.
+        self.advance_step()
+        self.update_canvas()
+
+    def step_back(self):
+        """
+        Go back one animation step, restoring the previous tick from the history when
+        needed. This method is effective only when the animation is paused.
+        """
+        if self.playing:
+            return
+        if self.current_step > 0:
+            self.current_step -= 1
+            self.update_canvas()
+        elif self.grid_obj.tick > self.history.earliest_tick:
+            self.seek(self.grid_obj.tick - 1, self.steps_per_rotation - 1)
+
+    def advance_step(self):
+        """Run one animation step, rotating the gears (and recording the tick) on the last one."""
         self.grid_obj.prepare_iteration()
         self.grid_obj.iterate()
         if self.current_step < self.steps_per_rotation - 1:
@@ -222,29 +276,98 @@ class GearApp(tk.Tk):
         else:
             self.current_step = 0
             self.grid_obj.rotate_gears()
+            self.history.record()
+            self.update_seek_scale()
+
+    def start_history(self):
+        """Start recording the history of the current grid."""
+        self.history = TickHistory(self.grid_obj)
+        self.update_seek_scale()
+
+    def update_seek_scale(self):
+        """Move the seek slider to the current tick and stretch it over the recorded range."""
+        self.seek_scale.config(from_=self.history.earliest_tick, to=self.history.latest_tick)
+        self.seek_scale.set(self.grid_obj.tick)
+
+    def on_seek(self, event):
+        """Seek to the tick selected with the slider."""
+        tick = int(self.seek_scale.get())
+        if tick != self.grid_obj.tick or self.current_step != 0:
+            self.seek(tick)
+
+    def seek(self, tick, sub_step=0):
+        """
+        Pause the animation and restore the grid to `tick` from the recorded keyframes.
+        """
+        if self.playing:
+            self.toggle_play()
+        tick = min(max(tick, self.history.earliest_tick), self.history.latest_tick)
+        self.history.restore(tick)
+        self.grid_obj.prepare_iteration()
+        self.grid_obj.iterate()
+        self.current_step = sub_step
+        self.update_seek_scale()
         self.update_canvas()
 
     def update_canvas(self):
         """Render the current gear grid frame and update the Tkinter image."""
         if self.visualizer:
             self.visualizer.draw_grid(self.angle_step * self.current_step)
+            start = self.profiler.clock()
             # Convert the OpenCV BGR image to RGB.
             cv_img_rgb = cv2.cvtColor(self.visualizer.canvas, cv2.COLOR_BGR2RGB)
+            if self.profiling:
+                self.draw_profile_overlay(cv_img_rgb)
             im = Image.fromarray(cv_img_rgb)
             imgtk = ImageTk.PhotoImage(image=im)
+            if self.profiling:
+                self.profiler.add_time("convert_to_tk", start)
             self.image_label.imgtk = imgtk  # Keep a reference.
             self.image_label.configure(image=imgtk)
 
+    def attach_profiler(self):
+        """Attach the profiler to the current grid and visualizer while profiling is on."""
+        if self.profiling:
+            self.profiler.attach(self.grid_obj, self.visualizer)
+
+    def toggle_profile(self):
+        """Turn the per-phase profiler and its overlay on or off."""
+        if self.profiling:
+            self.profiling = False
+            self.profiler.detach(self.grid_obj, self.visualizer)
+            self.btn_profile.config(text="Profile")
+        else:
+            self.profiling = True
+            self.profiler.reset()
+            self.attach_profiler()
+            self.btn_profile.config(text="Profile: On")
+        self.update_canvas()
+
+    def save_profile(self):
+        """Write the recorded per-tick profile to a CSV or JSON file."""
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV Files", "*.csv"), ("JSON Files", "*.json")]
+        )
+        if filename:
+            self.profiler.dump(filename)
+
+    def draw_profile_overlay(self, image):
+        """Draw the last tick's phase times and counters in the top-left corner of `image`."""
+        lines = self.profiler.overlay_lines()
+        # Darken the area behind the text so it stays readable over the gears.
+        image[:16 * len(lines) + 10, :240] //= 3
+        for line_idx, line in enumerate(lines):
+            position = (8, 18 + 16 * line_idx)
+            cv2.putText(image, line, position, cv2.FONT_HERSHEY_SIMPLEX, 0.45,
+                        (0, 0, 0), 3, cv2.LINE_AA)
+            cv2.putText(image, line, position, cv2.FONT_HERSHEY_SIMPLEX, 0.45,
+                        (255, 255, 255), 1, cv2.LINE_AA)
+
     def animation_loop(self):
         """The main animation loop using Tkinter's after() method."""
         if self.playing:
-            self.grid_obj.prepare_iteration()
-            self.grid_obj.iterate()
-            if self.current_step < self.steps_per_rotation - 1:
-                self.current_step += 1
-            else:
-                self.current_step = 0
-                self.grid_obj.rotate_gears()
+            self.advance_step()
             self.update_canvas()
             self.animation_job = self.after(1, self.animation_loop)
 
@@ -252,6 +375,7 @@ class GearApp(tk.Tk):
         """Cancel any pending jobs and close the window."""
         if self.animation_job is not None:
             self.after_cancel(self.animation_job)
+        self.frame_writer.close()
         self.destroy()
 
     # --- Mouse event handlers for panning and zooming ---